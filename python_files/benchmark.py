@@ -0,0 +1,519 @@
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from neo4j import GraphDatabase
+
+from create_and_fill_database import TABLES, YEAR_COLUMNS, create_and_fill_database, read_frames, select_years
+from instrumentation import measure as measure_block
+from process_datasets import (
+    join_rais_4,
+    join_rais_6,
+    lookup_df,
+    process_indicadores,
+    process_rais_4,
+    process_rais_6,
+    read_release_year
+)
+from queries import NEO4J_PASSWORD, NEO4J_URI, NEO4J_USER, QUERIES, query_parameters
+
+# Size of the real exports, multiplied by the scale factor
+MUNICIPIOS_1X = 5570
+CURSOS_1X = 40000
+
+SETORES = ['Agropecuária', 'Indústria', 'Construção', 'Comércio', 'Serviços']
+
+REGIOES = {
+    'Norte': ['RO', 'AC', 'AM', 'RR', 'PA', 'AP', 'TO'],
+    'Nordeste': ['MA', 'PI', 'CE', 'RN', 'PB', 'PE', 'AL', 'SE', 'BA'],
+    'Sudeste': ['MG', 'ES', 'RJ', 'SP'],
+    'Sul': ['PR', 'SC', 'RS'],
+    'Centro-Oeste': ['MS', 'MT', 'GO', 'DF']
+}
+
+CENSO_COLUMNS = [
+    'CO_IES', 'NO_IES', 'TP_CATEGORIA_ADMINISTRATIVA', 'TP_ORGANIZACAO_ACADEMICA', 'CO_CURSO', 'NO_CURSO',
+    'CO_REGIAO', 'CO_UF', 'CO_MUNICIPIO', 'TP_GRAU_ACADEMICO', 'TP_MODALIDADE_ENSINO', 'CO_CINE_ROTULO',
+    'NO_CINE_ROTULO', 'CO_CINE_AREA_GERAL', 'NO_CINE_AREA_GERAL', 'NU_ANO_INGRESSO', 'NU_ANO_REFERENCIA',
+    'NU_PRAZO_INTEGRALIZACAO', 'NU_ANO_INTEGRALIZACAO', 'NU_PRAZO_ACOMPANHAMENTO', 'NU_ANO_MAXIMO_ACOMPANHAMENTO',
+    'QT_INGRESSANTE', 'QT_PERMANENCIA', 'QT_CONCLUINTE', 'QT_DESISTENCIA', 'QT_FALECIDO', 'TAP', 'TCA', 'TDA',
+    'TCAN', 'TADA'
+]
+
+SYLLABLES = ['ba', 'ca', 'da', 'fe', 'go', 'ja', 'la', 'ma', 'na', 'pe', 'ri', 'sa', 'ta', 'va', 'xi', 'zu']
+
+PREFIXES = ['', '', '', 'São ', 'Santa ', 'Nova ', 'Porto ', 'Alto ', 'Barra do ']
+
+
+def municipio_names(n, rng):
+    """ Generate distinct, accented municipality names.
+
+    Args:
+        n: Number of names.
+        rng: NumPy random generator.
+    """
+    syllables = rng.choice(SYLLABLES, size=(n, 3))
+    prefixes = rng.choice(PREFIXES, size=n)
+    names = [f"{prefix}{''.join(parts).capitalize()}ã {i}" for i, (prefix, parts) in enumerate(zip(prefixes, syllables))]
+    return names
+
+
+def format_int(values, thousands):
+    """ Format integers with the thousands separator of a RAIS layout.
+
+    Args:
+        values: Array of integers.
+        thousands: ',' or '.'.
+    """
+    return [f"{v:,}".replace(',', thousands) for v in values]
+
+
+def write_rows(path, rows):
+    """ Write a list of rows as a CSV file.
+
+    Args:
+        path: Path to the CSV file.
+        rows: List of rows.
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+def generate_rais_4(path, year, municipios, with_codes, rng):
+    """ Generate a RAIS Tabela 4 export with the layout of the real files.
+
+    Releases with codes follow the 2023 layout ('Código' column, '.' as the
+    thousands separator), the others follow the 2021 layout (upper case names
+    without accents, ',' as the thousands separator and the stray
+    '5 - Comércio' label over the Serviços columns).
+
+    Args:
+        path: Path to the CSV file.
+        year: Base year of the release; the file holds year - 1 and year.
+        municipios: DataFrame with the uf_sigla, municipio_cod and municipio_nome columns.
+        with_codes: Boolean to use the 2023 layout.
+        rng: NumPy random generator.
+    """
+    n = len(municipios)
+    width = 28 if with_codes else 27
+    thousands = '.' if with_codes else ','
+    variacao = ['Variação Absoluta', 'Variação Relativa'] if with_codes else ['Vr Abs', 'Vr (%)']
+
+    rows = [[''] * width for _ in range(6)]
+    rows.append(['', 'RAIS - Divulgação: Dezembro de 2024'] + [''] * (width - 2))
+    rows.append([''] * width)
+    rows.append([''] * width)
+    rows.append(['', f"Ano: {year}", '', '' if with_codes else 'Brasil'] + [''] * (width - 4))
+    rows.append([''] * width)
+    rows.append([''] * width)
+
+    ids = ['', 'UF', 'Código', 'Município'] if with_codes else ['', 'UF', 'Município']
+    header = list(ids)
+    years = [''] * len(ids)
+    for setor in SETORES + ['Total']:
+        header += [setor, '', '', '']
+        years += [str(year - 1), str(year)] + variacao
+    if not with_codes:
+        header[header.index('Serviços') + 1] = '5 - Comércio'
+    rows += [header[:width], years[:width], [''] * width]
+
+    if with_codes:
+        names = municipios['municipio_nome'].tolist()
+    else:
+        names = [name.upper().replace('Ã', 'A').replace('Ç', 'C') for name in municipios['municipio_nome']]
+
+    columns = [[''] * n, municipios['uf_sigla'].tolist()]
+    if with_codes:
+        columns.append(municipios['municipio_cod'].astype(str).tolist())
+    columns.append(names)
+
+    totals = np.zeros((n, 2), dtype=np.int64)
+    for _ in SETORES:
+        values = rng.integers(0, 20000, size=(n, 2))
+        totals += values
+        columns += [format_int(values[:, 0], thousands), format_int(values[:, 1], thousands),
+                    format_int(values[:, 1] - values[:, 0], thousands), ['0,0%'] * n]
+    columns += [format_int(totals[:, 0], thousands), format_int(totals[:, 1], thousands), [''] * n, [''] * n]
+
+    rows += [list(row[:width]) for row in zip(*columns)]
+    rows.append([''] * width)
+    rows.append(['', 'Fonte: RAIS / MTE'] + [''] * (width - 2))
+
+    write_rows(path, rows)
+
+
+def generate_rais_6(path, year, brazilian, rng):
+    """ Generate a RAIS Tabela 6 export with the layout of the real files.
+
+    Args:
+        path: Path to the CSV file.
+        year: Base year of the release; the file holds year - 1 and year.
+        brazilian: Boolean to use the 2023 number format ('3.893,99') instead of the 2021 one ('3,625.99').
+        rng: NumPy random generator.
+    """
+    def money(value):
+        text = f"{value:,.2f}"
+        return text.replace(',', '_').replace('.', ',').replace('_', '.') if brazilian else text
+
+    uf_nomes = dict(zip(lookup_df['uf_sigla'], lookup_df['uf_nome']))
+    label = 'Remuneração Real Média em Dezembro'
+
+    rows = [['14'] + [''] * 6] + [[''] * 7 for _ in range(5)]
+    rows.append(['', 'RAIS - Divulgação: Dezembro de 2024'] + [''] * 5)
+    rows.append([''] * 7)
+    rows.append(['', f"Ano: {year}", '', 'Brasil', '', '', ''])
+    rows += [[''] * 7, [''] * 7]
+    if brazilian:
+        rows.append(['', 'Indicadores', '', str(year - 1), str(year), 'Variação Absoluta', 'Variação Relativa'])
+    else:
+        rows.append(['', 'Indicadores', '', 'Ano', '', 'Variação', ''])
+        rows.append(['', '', '', str(year - 1), str(year), 'Absoluta', 'Relativa (%)'])
+
+    def value_row(first, name):
+        before, after = rng.uniform(2000, 7000, size=2)
+        return ['', first, name, money(before), money(after), money(after - before), '0,0%']
+
+    rows.append(value_row(label, ''))
+    rows.append(['', 'Região e UF', '', '', '', '', ''])
+    for regiao, ufs in REGIOES.items():
+        rows.append(value_row(label, regiao))
+        rows += [value_row('', uf_nomes[uf]) for uf in ufs]
+    rows.append(['', 'Grupamento de Atividades Econômicas e Seção CNAE 2.0', '', '', '', '', ''])
+    rows.append(value_row(label, 'Agricultura, pecuária, produção florestal, pesca e aquicultura'))
+    rows += [value_row('', setor) for setor in SETORES]
+    rows.append(['', 'Fonte: RAIS / STRAB-MTP', '', '', '', '', ''])
+
+    write_rows(path, rows)
+
+
+def generate_censo(path, cursos, anos, municipios, rng):
+    """ Generate a Censo da Educação Superior trajectory file with the layout of the real one.
+
+    Args:
+        path: Path to the CSV file.
+        cursos: Number of courses.
+        anos: List of reference years; every course has one row per year.
+        municipios: DataFrame with the uf_sigla and municipio_cod columns.
+        rng: NumPy random generator.
+    """
+    co_uf = dict(zip(lookup_df['uf_sigla'], lookup_df['CO_UF']))
+    n = cursos * len(anos)
+
+    course = np.tile(np.arange(cursos), len(anos))
+    municipio = rng.integers(0, len(municipios), size=cursos)[course]
+    inst = rng.integers(1, max(cursos // 20, 2), size=cursos)[course]
+    area = rng.integers(1, 11, size=cursos)[course]
+
+    df = pd.DataFrame({column: rng.integers(1, 9, size=n) for column in CENSO_COLUMNS})
+    df['CO_IES'] = inst
+    df['NO_IES'] = [f"Instituição de Ensino {i}" for i in inst]
+    df['CO_CURSO'] = course + 1
+    df['NO_CURSO'] = [f"Curso de Formação {c % 500}" for c in course]
+    df['CO_UF'] = municipios['uf_sigla'].map(co_uf).to_numpy()[municipio]
+    df['CO_MUNICIPIO'] = municipios['municipio_cod'].to_numpy()[municipio]
+    df['CO_CINE_AREA_GERAL'] = area
+    df['NO_CINE_AREA_GERAL'] = [f"Área {a}" for a in area]
+    df['NU_ANO_REFERENCIA'] = np.repeat(anos, cursos)
+    df['QT_INGRESSANTE'] = rng.integers(0, 200, size=n)
+    df['QT_CONCLUINTE'] = rng.integers(0, 150, size=n)
+    df['TDA'] = [f"{v:.2f}".replace('.', ',') for v in rng.uniform(0, 100, size=n)]
+
+    # A few rows with missing values, dropped by the pipeline
+    df.loc[rng.random(n) < 0.01, 'QT_CONCLUINTE'] = None
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for line in range(8):
+            f.write(f"Indicadores de Trajetória da Educação Superior{',' * (len(CENSO_COLUMNS) - 1)}\n" if line == 1 else ',' * (len(CENSO_COLUMNS) - 1) + '\n')
+        df.to_csv(f, index=False)
+
+
+def generate_datasets(data_dir, scale, releases=2, seed=42):
+    """ Generate every input file of the pipeline at a given scale.
+
+    Args:
+        data_dir: Directory where the files will be saved.
+        scale: Factor applied to the number of municipalities and courses.
+        releases: Number of RAIS releases, two years apart, ending in 2023. Only the latest one has municipality codes.
+        seed: Seed of the random generator.
+
+    Returns:
+        A dictionary with the paths of the 'indicadores', 'rais_4' and 'rais_6' inputs.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    n = int(MUNICIPIOS_1X * scale)
+    ufs = lookup_df['uf_sigla'].to_numpy()[rng.integers(0, len(lookup_df), size=n)]
+    municipios = pd.DataFrame({
+        'uf_sigla': ufs,
+        'municipio_cod': 1000000 + np.arange(n),
+        'municipio_nome': municipio_names(n, rng)
+    }).sort_values(['uf_sigla', 'municipio_cod'], ignore_index=True)
+
+    years = [2023 - 2 * i for i in reversed(range(releases))]
+    paths = {'indicadores': os.path.join(data_dir, 'censo_trajetoria.csv'), 'rais_4': [], 'rais_6': []}
+
+    for year in years:
+        rais_4 = os.path.join(data_dir, f"RAIS_ano_base_{year}_TABELA4.csv")
+        rais_6 = os.path.join(data_dir, f"RAIS_ano_base_{year}_TABELA6.csv")
+        generate_rais_4(rais_4, year, municipios, year == years[-1], rng)
+        generate_rais_6(rais_6, year, year == years[-1], rng)
+        paths['rais_4'].append(rais_4)
+        paths['rais_6'].append(rais_6)
+
+    anos = list(range(years[0] - 1, years[-1] + 1))
+    generate_censo(paths['indicadores'], int(CURSOS_1X * scale), anos, municipios, rng)
+
+    return paths
+
+
+def measure(scale, stage, func, *args):
+    """ Run one stage and record its wall time, output rows and peak RSS.
+
+    Args:
+        scale: Scale factor of the input files.
+        stage: Name of the stage.
+        func: Function that runs the stage.
+        args: Arguments passed to func.
+    """
+    with measure_block(None, 'stage', stage) as stats:
+        result = func(*args)
+        if stats['rows_out'] is None and result is not None:
+            stats['rows_out'] = len(result)
+
+    rows = stats['rows_out'] or 0
+    record = {
+        'scale': scale,
+        'stage': stage,
+        'wall_s': stats['wall_s'],
+        'rows': rows,
+        'rows_per_s': round(rows / stats['wall_s'], 1) if stats['wall_s'] else None,
+        'peak_rss_mb': stats['peak_rss_mb']
+    }
+    print(f"{scale:>6}x {stage:<22} {record['wall_s']:>9.3f}s {rows:>10} rows {record['rows_per_s'] or 0:>12.0f} rows/s {record['peak_rss_mb']:>9.1f} MiB")
+
+    return result, record
+
+
+def run_benchmark(workdir, scales, releases=2):
+    """ Generate the synthetic inputs and measure every stage of the pipeline at each scale.
+
+    Args:
+        workdir: Directory for the generated inputs and the outputs.
+        scales: List of scale factors.
+        releases: Number of RAIS releases generated for each scale.
+    """
+    records = []
+    for scale in scales:
+        data_dir = os.path.join(workdir, f"scale_{scale}", 'input')
+        output_dir = os.path.join(workdir, f"scale_{scale}", 'output')
+        os.makedirs(output_dir, exist_ok=True)
+
+        paths = generate_datasets(data_dir, scale, releases)
+
+        # The crosswalk cache would hide the fuzzy matching cost
+        crosswalk_csv = os.path.join(output_dir, 'municipio_crosswalk.csv')
+        if os.path.exists(crosswalk_csv):
+            os.remove(crosswalk_csv)
+
+        _, record = measure(scale, 'process_indicadores', process_indicadores, paths['indicadores'], output_dir)
+        records.append(record)
+
+        rais_4 = []
+        for path in paths['rais_4']:
+            df, record = measure(scale, f"process_rais_4 {read_release_year(path)}", process_rais_4, path, output_dir)
+            rais_4.append(df)
+            records.append(record)
+
+        rais_6 = []
+        for path in paths['rais_6']:
+            df, record = measure(scale, f"process_rais_6 {read_release_year(path)}", process_rais_6, path, output_dir)
+            rais_6.append(df)
+            records.append(record)
+
+        _, record = measure(scale, 'join_rais_4', join_rais_4, rais_4, output_dir, crosswalk_csv)
+        records.append(record)
+        _, record = measure(scale, 'join_rais_6', join_rais_6, rais_6, output_dir)
+        records.append(record)
+
+    return records
+
+
+def run_query_benchmark(workdir, scale, releases=2, repeats=5):
+    """ Load the synthetic data one year at a time and measure the employment queries after each year.
+
+    The years are loaded from the latest one backwards, so the year filtered
+    by the queries is there from the first step and every later step only
+    adds older years. The database should be empty: the synthetic nodes are
+    added to whatever it holds.
+
+    Args:
+        workdir: Directory for the generated inputs and the outputs.
+        scale: Scale factor of the input files.
+        releases: Number of RAIS releases generated, two years each.
+        repeats: Number of measured runs of each query, after one warm-up run.
+    """
+    records = run_benchmark(workdir, [scale], releases)
+    frames = read_frames(os.path.join(workdir, f"scale_{scale}", 'output'))
+    years = sorted({int(year) for table in TABLES for year in frames[table][YEAR_COLUMNS[table]].dropna()}, reverse=True)
+
+    # The queries that read the employment counts
+    titles = [title for title in QUERIES if title.startswith(('1.', '3.'))]
+
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    try:
+        for loaded, year in enumerate(years, start=1):
+            create_and_fill_database(driver, loader='unwind', frames=select_years(frames, [year]))
+
+            with driver.session() as session:
+                for title in titles:
+                    query, parameters = QUERIES[title]['query'], query_parameters(title)
+                    session.run(query, parameters).consume()
+                    timings = []
+                    for _ in range(repeats):
+                        with measure_block(None, 'query', title) as stats:
+                            stats['rows_out'] = len(list(session.run(query, parameters)))
+                        timings.append(stats['wall_s'])
+
+                    record = {
+                        'scale': scale,
+                        'stage': f"query {title.split('.')[0]} ({loaded} years)",
+                        'years': loaded,
+                        'wall_s': float(np.median(timings)),
+                        'rows': stats['rows_out'],
+                        'peak_rss_mb': stats['peak_rss_mb']
+                    }
+                    print(f"{scale:>6}x {record['stage']:<22} {record['wall_s']:>9.3f}s {record['rows']:>10} rows")
+                    records.append(record)
+    finally:
+        driver.close()
+
+    return records
+
+
+def compare_baseline(records, baseline, tolerance):
+    """ Compare the wall time of each stage with a stored baseline.
+
+    Args:
+        records: Records returned by run_benchmark.
+        baseline: Records of a previous run.
+        tolerance: Relative slowdown above which a stage is reported as a regression.
+
+    Returns:
+        The list of (scale, stage, ratio) regressions.
+    """
+    previous = {(record['scale'], record['stage']): record for record in baseline}
+    regressions = []
+
+    print("\nComparison with the baseline (wall time and peak RSS ratios):")
+    for record in records:
+        key = (record['scale'], record['stage'])
+        if key not in previous:
+            print(f"{record['scale']:>6}x {record['stage']:<22} not in baseline")
+            continue
+
+        wall_ratio = record['wall_s'] / previous[key]['wall_s'] if previous[key]['wall_s'] else float('inf')
+        rss_ratio = record['peak_rss_mb'] / previous[key]['peak_rss_mb'] if previous[key]['peak_rss_mb'] else float('inf')
+        flag = 'REGRESSION' if wall_ratio > 1 + tolerance else ''
+        print(f"{record['scale']:>6}x {record['stage']:<22} {wall_ratio:>6.2f}x time {rss_ratio:>6.2f}x memory {flag}")
+        if flag:
+            regressions.append((record['scale'], record['stage'], wall_ratio))
+
+    return regressions
+
+
+def main(workdir, scales, releases, baseline_file, save_baseline, tolerance, results_file, queries=False):
+    """ Main function to benchmark the preprocessing pipeline on synthetic data.
+
+    Args:
+        workdir: Directory for the generated inputs and the outputs.
+        scales: List of scale factors.
+        releases: Number of RAIS releases generated for each scale.
+        baseline_file: Path to the baseline JSON file.
+        save_baseline: Boolean to store this run as the new baseline.
+        tolerance: Relative slowdown above which a stage is reported as a regression.
+        results_file: Path to the JSON file where the results of this run are saved, or None.
+        queries: Boolean to also load each scale into the Neo4j database, one year at a time, and measure queries 1 and 3.
+    """
+    if queries:
+        records = [record for scale in scales for record in run_query_benchmark(workdir, scale, releases)]
+    else:
+        records = run_benchmark(workdir, scales, releases)
+
+    if results_file is not None:
+        with open(results_file, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=2)
+
+    if save_baseline:
+        with open(baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=2)
+        print(f"\nBaseline saved to {baseline_file}")
+    elif os.path.exists(baseline_file):
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(records, baseline, tolerance)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} stages are slower than the baseline")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the preprocessing pipeline on synthetic RAIS and Censo files."
+    )
+    parser.add_argument(
+        "-s",
+        "--scales",
+        nargs="+",
+        type=float,
+        default=[1],
+        help="Scale factors applied to the number of municipalities and courses (e.g. 1 10 100)."
+    )
+    parser.add_argument(
+        "-r",
+        "--releases",
+        type=int,
+        default=2,
+        help="Number of RAIS releases (two years each) generated for each scale."
+    )
+    parser.add_argument(
+        "-w",
+        "--workdir",
+        default="benchmark_data",
+        help="Directory for the generated inputs and the outputs."
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        default="benchmark_baseline.json",
+        help="Path to the baseline JSON file."
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run as the new baseline instead of comparing against it."
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown above which a stage is reported as a regression."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="Path to a JSON file where the results of this run are saved."
+    )
+    parser.add_argument(
+        "-q",
+        "--queries",
+        action="store_true",
+        help="Also load the data into an empty Neo4j database, one year at a time, and measure the latency of queries 1 and 3 after each year."
+    )
+    args = parser.parse_args()
+
+    main(args.workdir, args.scales, args.releases, args.baseline, args.save_baseline, args.tolerance, args.output, args.queries)
@@ -1,14 +1,192 @@
 import neo4j
 from neo4j import GraphDatabase
 import argparse
+import hashlib
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def create_and_fill_database(driver):
-    """ Create the Neo4j database and schema.
-    Args:
-        driver: Neo4j driver to connect to the database.
-    """
-    
-    commands = ["""
+import pandas as pd
+
+from instrumentation import SUMMARY_COUNTERS, measure, open_metrics, summary_counters
+from pipeline import file_hash
+from process_datasets import SCHEMAS
+
+# Uniqueness constraints on every MERGE/MATCH key, each one backed by an index.
+# A tuple is a composite key.
+CONSTRAINTS = {
+    'Curso': 'codigo',
+    'InstituicaoSuperior': 'codigo',
+    'AreaAtuacao': 'codigo',
+    'Municipio': 'codigo',
+    'UnidadeFederativa': 'sigla',
+    'SetorEconomico': 'nome',
+    'Emprego': ('setor', 'municipio', 'ano'),
+    'LoadCheckpoint': 'step'
+}
+
+# Composite node indexes looked up by the queries: the employment of one sector in one year
+NODE_INDEXES = {
+    'Emprego': [('setor', 'ano')]
+}
+
+# Accent-folded, lowercased name of the searchable nodes (normalize_string of
+# process_datasets.py), backed by a text index for CONTAINS and a full-text
+# index for word and phrase searches
+SEARCH_PROPERTY = 'busca'
+SEARCH_LABELS = ['Curso', 'InstituicaoSuperior', 'Municipio', 'SetorEconomico']
+
+# Relationship properties filtered by the queries: the years, and the numeric range on the dropout rate
+RELATIONSHIP_INDEXES = {
+    'TRAJETORIA_DO_CURSO': ['ano', 'taxa_desistencia']
+}
+
+# The average remuneration of each year is a property of the UF node, named with this prefix and the year
+REMUNERACAO_PREFIX = 'media_remuneracao_'
+
+INDEX_TIMEOUT = 300
+
+# Rows per transaction of each LOAD CSV command. The first command merges
+# seven entity and relationship kinds per row, so it gets smaller batches.
+DEFAULT_BATCH_SIZE = 1000
+BATCH_SIZES = {
+    'indicadores': 500,
+    'trajetoria_do_curso': 2000,
+    'emprego': 5000
+}
+
+LOADERS = ('csv', 'unwind')
+
+# Processed tables read by the UNWIND loader, as saved by process_datasets.py
+TABLES = ['indicadores_educacao', 'rais_tabela4_joined', 'rais_tabela6_joined']
+
+# Year column of each processed table, used to load a single year or range
+YEAR_COLUMNS = {
+    'indicadores_educacao': 'ano_referencia',
+    'rais_tabela4_joined': 'ano',
+    'rais_tabela6_joined': 'ano'
+}
+
+# Node sets of the UNWIND loader, merged once per distinct key in the first
+# phase: the table they come from, the key property, the properties set on
+# creation and the column of the search key, set on every load.
+NODES = {
+    'AreaAtuacao': {
+        'table': 'indicadores_educacao',
+        'key': ('codigo', 'area_cod'),
+        'properties': {'nome': 'nome_area_atuacao'}
+    },
+    'Curso': {
+        'table': 'indicadores_educacao',
+        'key': ('codigo', 'curso_cod'),
+        'properties': {'nome': 'curso_nome', 'grau_academico': 'grau_academico', 'modo_ensino': 'modo_ensino'},
+        'search': 'curso_busca'
+    },
+    'InstituicaoSuperior': {
+        'table': 'indicadores_educacao',
+        'key': ('codigo', 'inst_cod'),
+        'properties': {'nome': 'inst_nome', 'categoria_adm': 'categoria_adm', 'org_academica': 'org_academica'},
+        'search': 'inst_busca'
+    },
+    'UnidadeFederativa': {
+        'table': 'indicadores_educacao',
+        'key': ('sigla', 'uf_sigla'),
+        'properties': {'nome': 'uf_nome'}
+    },
+    'Municipio': {
+        'table': 'rais_tabela4_joined',
+        'key': ('codigo', 'municipio_cod'),
+        'properties': {'nome': 'municipio_nome'},
+        'search': 'municipio_busca'
+    },
+    'SetorEconomico': {
+        'table': 'rais_tabela4_joined',
+        'key': ('nome', 'setor_nome'),
+        'properties': {},
+        'search': 'setor_busca'
+    }
+}
+
+# Relationships of the UNWIND loader, merged once per distinct edge in the
+# second phase: the source and target nodes (label and key column) and the
+# properties of the relationship pattern. The yearly measures are merged on
+# (source, target, ano) only and the other properties are set, so a corrected
+# value updates the relationship instead of adding one. The largest sets name a partition
+# column, the UF of the municipality: every municipality is in a single
+# partition, so parallel writers never lock the same Municipio node.
+EDGES = {
+    'curso_area': {
+        'table': 'indicadores_educacao',
+        'type': 'PERTENCE_A',
+        'source': ('Curso', 'curso_cod'),
+        'target': ('AreaAtuacao', 'area_cod'),
+        'properties': {}
+    },
+    'curso_instituicao': {
+        'table': 'indicadores_educacao',
+        'type': 'OFERECIDO_POR',
+        'source': ('Curso', 'curso_cod'),
+        'target': ('InstituicaoSuperior', 'inst_cod'),
+        'properties': {}
+    },
+    'instituicao_uf': {
+        'table': 'indicadores_educacao',
+        'type': 'LOCALIZADA_EM',
+        'source': ('InstituicaoSuperior', 'inst_cod'),
+        'target': ('UnidadeFederativa', 'uf_sigla'),
+        'properties': {}
+    },
+    'municipio_uf': {
+        'table': 'rais_tabela4_joined',
+        'type': 'LOCALIZADO_EM',
+        'source': ('Municipio', 'municipio_cod'),
+        'target': ('UnidadeFederativa', 'uf_sigla'),
+        'properties': {}
+    },
+    'trajetoria_do_curso': {
+        'table': 'indicadores_educacao',
+        'type': 'TRAJETORIA_DO_CURSO',
+        'source': ('Curso', 'curso_cod'),
+        'target': ('Municipio', 'municipio_cod'),
+        'properties': {'ano': 'ano_referencia', 'ingressantes': 'num_ingressantes', 'concluintes': 'num_concluintes', 'taxa_desistencia': 'taxa_desistencia'},
+        'merge_on': ['ano'],
+        'partition': 'uf_sigla'
+    }
+}
+
+# Employment facts: one Emprego node per (setor, municipio, ano), linked to its
+# municipality and looked up by the sector through the Emprego indexes, so
+# the five SetorEconomico nodes do not gather an edge per municipality and year.
+EMPREGO = {
+    'table': 'rais_tabela4_joined',
+    'key': {'setor': 'setor_nome', 'municipio': 'municipio_cod', 'ano': 'ano'},
+    'properties': {'num_empregados': 'num_pessoas_empregadas'},
+    'type': 'EM_MUNICIPIO',
+    'partition': 'uf_sigla'
+}
+
+# Areas of study related to each economic sector, merged by the area_setores step
+AREA_SETORES = {
+    1: ['Serviços'],
+    2: ['Serviços'],
+    3: ['Serviços'],
+    4: ['Serviços', 'Comércio'],
+    5: ['Serviços', 'Comércio', 'Indústria'],
+    6: ['Serviços', 'Comércio', 'Indústria'],
+    7: ['Agropecuária', 'Indústria', 'Construção'],
+    8: ['Agropecuária', 'Indústria', 'Serviços'],
+    9: ['Serviços'],
+    10: ['Serviços', 'Comércio']
+}
+
+# Steps of the LOAD CSV loader: the files each one reads from the Neo4j import
+# directory, the steps whose nodes it matches, and its command.
+COMMANDS = {
+    'indicadores': {
+        'inputs': ['indicadores_educacao.csv'],
+        'deps': [],
+        'query': """
     LOAD CSV WITH HEADERS FROM 'file:///indicadores_educacao.csv' AS edu
     FIELDTERMINATOR ';'
 
@@ -19,15 +197,17 @@ def create_and_fill_database(driver):
     WITH edu, toInteger(edu.curso_cod) AS curso_cod, edu.curso_nome AS nome, toInteger(edu.grau_academico) AS grau, toInteger(edu.modo_ensino) AS modo
     MERGE (curso:Curso{codigo: curso_cod})
     ON CREATE SET curso.nome=nome, curso.grau_academico=grau, curso.modo_ensino=modo
+    SET curso.busca=edu.curso_busca
 
     WITH edu, toInteger(edu.curso_cod) AS curso_cod, toInteger(edu.area_cod) AS area_cod
     MATCH (c: Curso {codigo: toInteger(edu.curso_cod)})
     MATCH (a:AreaAtuacao {codigo: area_cod})
     MERGE (c)-[:PERTENCE_A]->(a)
 
-    WITH edu, toInteger(edu.inst_cod) AS inst_cod, edu.inst_nome AS nome, edu.categoria_adm AS categoria, edu.org_academica AS org
+    WITH edu, toInteger(edu.inst_cod) AS inst_cod, edu.inst_nome AS nome, toInteger(edu.categoria_adm) AS categoria, toInteger(edu.org_academica) AS org
     MERGE (inst:InstituicaoSuperior {codigo: inst_cod})
     ON CREATE SET inst.nome=nome, inst.categoria_adm=categoria, inst.org_academica=org
+    SET inst.busca=edu.inst_busca
 
     WITH edu, edu.uf_sigla AS uf, edu.uf_nome AS nome
     MERGE (unid:UnidadeFederativa {sigla: uf})
@@ -36,155 +216,1034 @@ def create_and_fill_database(driver):
     WITH edu
     MATCH (c:Curso {codigo: toInteger(edu.curso_cod)})
     MATCH (i:InstituicaoSuperior {codigo: toInteger(edu.inst_cod)})
-    MERGE (c)-[:PERTENCE_A]->(i)
+    MERGE (c)-[:OFERECIDO_POR]->(i)
 
     WITH edu
     MATCH (i:InstituicaoSuperior {codigo: toInteger(edu.inst_cod)})
     MATCH (u:UnidadeFederativa {sigla: edu.uf_sigla})
     MERGE (i)-[:LOCALIZADA_EM]->(u)
-    """,
-
     """
+    },
+    'municipios_setores': {
+        'inputs': ['rais_tabela4_joined.csv'],
+        'deps': ['indicadores'],
+        'query': """
     LOAD CSV WITH HEADERS FROM 'file:///rais_tabela4_joined.csv' AS rais4
     FIELDTERMINATOR ';'
 
     WITH rais4, toInteger(rais4.municipio_cod) AS municipio_cod, rais4.municipio_nome AS nome, rais4.uf_sigla AS uf
     MERGE (mun:Municipio {codigo: municipio_cod})
     ON CREATE SET mun.nome=nome
+    SET mun.busca=rais4.municipio_busca
     WITH*
     MATCH (u:UnidadeFederativa {sigla: uf})
     MERGE (mun)-[:LOCALIZADO_EM]->(u)
 
     WITH rais4, rais4.setor_nome AS setor
-    MERGE (:SetorEconomico {nome: setor})
-    """,
-
+    MERGE (s:SetorEconomico {nome: setor})
+    SET s.busca=rais4.setor_busca
     """
+    },
+    'trajetoria_do_curso': {
+        'inputs': ['indicadores_educacao.csv'],
+        'deps': ['indicadores', 'municipios_setores'],
+        'query': """
     LOAD CSV WITH HEADERS FROM 'file:///indicadores_educacao.csv' AS edu
     FIELDTERMINATOR ';'
 
-    WITH edu, toInteger(edu.municipio_cod) AS municipio_cod, toInteger(edu.ano_referencia) AS ano, edu.num_ingressantes AS ingressantes, edu.num_concluintes AS concluintes, edu.taxa_desistencia AS taxa_desistencia
+    WITH edu, toInteger(edu.municipio_cod) AS municipio_cod, toInteger(edu.ano_referencia) AS ano, toInteger(edu.num_ingressantes) AS ingressantes, toInteger(edu.num_concluintes) AS concluintes, toFloat(edu.taxa_desistencia) AS taxa_desistencia
     MATCH (mun:Municipio {codigo: municipio_cod})
     MATCH (c:Curso {codigo: toInteger(edu.curso_cod)})
-    MERGE (c)-[:TRAJETORIA_DO_CURSO {ano: ano, ingressantes: ingressantes, concluintes: concluintes,taxa_desistencia: taxa_desistencia}]->(mun)
-    """,
-
+    MERGE (c)-[traj:TRAJETORIA_DO_CURSO {ano: ano}]->(mun)
+    SET traj.ingressantes=ingressantes, traj.concluintes=concluintes, traj.taxa_desistencia=taxa_desistencia
     """
+    },
+    'media_remuneracao': {
+        'inputs': ['rais_tabela6_joined.csv'],
+        'deps': ['indicadores'],
+        'query': """
     LOAD CSV WITH HEADERS FROM 'file:///rais_tabela6_joined.csv' AS rais6
     FIELDTERMINATOR ';'
 
     WITH rais6, rais6.uf_sigla AS uf, toFloat(rais6.media_remuneracao) AS media_remuneracao, toInteger(rais6.ano) AS ano
-    MERGE (med:MediaRemuneracao {media_remuneracao: media_remuneracao})
-
-    WITH *
     MATCH (u:UnidadeFederativa {sigla: uf})
-    MATCH (med:MediaRemuneracao {media_remuneracao: media_remuneracao})
-    MERGE (u)-[:MEDIA_REMUNERACAO_ANUAL {ano: ano}]->(med)
-    """,
-
+    SET u['media_remuneracao_' + toString(ano)] = media_remuneracao
     """
+    },
+    'emprego': {
+        'inputs': ['rais_tabela4_joined.csv'],
+        'deps': ['municipios_setores'],
+        'query': """
     LOAD CSV WITH HEADERS FROM 'file:///rais_tabela4_joined.csv' AS rais4
     FIELDTERMINATOR ';'
 
     WITH rais4, toInteger(rais4.municipio_cod) AS municipio_cod, toInteger(rais4.num_pessoas_empregadas) AS num_empregados, rais4.setor_nome AS setor_nome, toInteger(rais4.ano) AS ano
     MATCH (mun:Municipio {codigo: municipio_cod})
     MATCH (setor:SetorEconomico {nome: setor_nome})
-    MERGE (setor)-[:NUMERO_PESSOAS_EMPREGADAS {num_empregados: num_empregados, ano:ano}]->(mun)
-    """,
-    
+    MERGE (emp:Emprego {setor: setor.nome, municipio: municipio_cod, ano: ano})
+    SET emp.num_empregados=num_empregados
+    MERGE (emp)-[:EM_MUNICIPIO]->(mun)
     """
-    MATCH (a:AreaAtuacao {codigo: 1}), 
-    (s:SetorEconomico {nome: 'Serviços'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s)
-    """,
+    }
+}
+
+# Types of the numeric properties in the neo4j-admin import headers, the
+# same ones the Cypher loaders store; every other property is text.
+IMPORT_TYPES = {
+    'AreaAtuacao': {'codigo': 'int'},
+    'Curso': {'codigo': 'int', 'grau_academico': 'int', 'modo_ensino': 'int'},
+    'InstituicaoSuperior': {'codigo': 'int', 'categoria_adm': 'int', 'org_academica': 'int'},
+    'Municipio': {'codigo': 'int'},
+    'Emprego': {'municipio': 'int', 'ano': 'int', 'num_empregados': 'int'},
+    'TRAJETORIA_DO_CURSO': {'ano': 'int', 'ingressantes': 'int', 'concluintes': 'int', 'taxa_desistencia': 'double'}
+}
+
+# One-off migrations of an existing database. Each step updates at most
+# $batch_size elements per transaction, only among the ones not migrated yet,
+# and is repeated until it returns no rows, so a stopped migration resumes
+# where it was interrupted. Steps without $batch_size run once.
+MIGRATIONS = {
+    'measure_types': {
+        'trajetoria_do_curso': """
+        MATCH ()-[r:TRAJETORIA_DO_CURSO]->()
+        WHERE r.ingressantes IS :: STRING NOT NULL OR r.concluintes IS :: STRING NOT NULL OR r.taxa_desistencia IS :: STRING NOT NULL
+        WITH r LIMIT $batch_size
+        SET r.ingressantes = toInteger(r.ingressantes), r.concluintes = toInteger(r.concluintes), r.taxa_desistencia = toFloat(r.taxa_desistencia)
+        RETURN count(r) AS rows
+        """,
+        'instituicao_superior': """
+        MATCH (i:InstituicaoSuperior)
+        WHERE i.categoria_adm IS :: STRING NOT NULL OR i.org_academica IS :: STRING NOT NULL
+        WITH i LIMIT $batch_size
+        SET i.categoria_adm = toInteger(i.categoria_adm), i.org_academica = toInteger(i.org_academica)
+        RETURN count(i) AS rows
+        """
+    },
+    'remodel': {
+        'oferecido_por': """
+        MATCH (c:Curso)-[r:PERTENCE_A]->(i:InstituicaoSuperior)
+        WITH c, r, i LIMIT $batch_size
+        MERGE (c)-[:OFERECIDO_POR]->(i)
+        DELETE r
+        RETURN count(*) AS rows
+        """,
+        'remuneracao_uf': """
+        MATCH (u:UnidadeFederativa)-[r:MEDIA_REMUNERACAO_ANUAL]->(med:MediaRemuneracao)
+        WITH u, r, med LIMIT $batch_size
+        SET u['media_remuneracao_' + toString(r.ano)] = toFloat(med.media_remuneracao)
+        DELETE r
+        RETURN count(*) AS rows
+        """,
+        'media_remuneracao_nodes': """
+        MATCH (med:MediaRemuneracao)
+        WHERE NOT (med)--()
+        WITH med LIMIT $batch_size
+        DELETE med
+        RETURN count(*) AS rows
+        """,
+        'drop_media_remuneracao_constraint': "DROP CONSTRAINT mediaremuneracao_media_remuneracao IF EXISTS",
+        'drop_media_remuneracao_anual_index': "DROP INDEX media_remuneracao_anual_ano IF EXISTS"
+    },
+    'emprego': {
+        'emprego': """
+        MATCH (s:SetorEconomico)-[r:NUMERO_PESSOAS_EMPREGADAS]->(m:Municipio)
+        WITH s, r, m LIMIT $batch_size
+        MERGE (e:Emprego {setor: s.nome, municipio: m.codigo, ano: r.ano})
+        SET e.num_empregados = r.num_empregados
+        MERGE (e)-[:EM_MUNICIPIO]->(m)
+        DELETE r
+        RETURN count(*) AS rows
+        """,
+        'drop_numero_pessoas_empregadas_index': "DROP INDEX numero_pessoas_empregadas_ano IF EXISTS"
+    }
+}
+
+LOAD_CSV = re.compile(r"^(\s*LOAD CSV\b.*?\bAS (\w+)\s+FIELDTERMINATOR '.'\s*)(.*)$", re.DOTALL)
+
+# Progress of the load, one LoadCheckpoint node per step or partition. The
+# fingerprint identifies the rows, query and batch size the batches were cut
+# from, so an interrupted load only resumes the batches of the same plan.
+SAVE_CHECKPOINT = """
+MERGE (k:LoadCheckpoint {step: $step})
+SET k.fingerprint = $fingerprint, k.batches = $batches, k.completed = $completed, k.updated_at = datetime()
+"""
+READ_CHECKPOINTS = """
+MATCH (k:LoadCheckpoint)
+RETURN k.step AS step, k.fingerprint AS fingerprint, k.batches AS batches, k.completed AS completed
+"""
+CLEAR_CHECKPOINTS = "MATCH (k:LoadCheckpoint) DELETE k"
+
+
+def create_schema(driver, metrics=None, timeout=INDEX_TIMEOUT):
+    """ Create the constraints and indexes used by the load, and wait for them to come online.
+
+    Every command uses IF NOT EXISTS, so running it again is harmless.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the commands.
+        timeout: Seconds to wait for the indexes to be populated.
+    """
+    commands = {}
+    for label, key in CONSTRAINTS.items():
+        keys = key if isinstance(key, tuple) else (key,)
+        name = '_'.join((label.lower(), *keys))
+        commands[f"constraint_{label}_{'_'.join(keys)}"] = f"""
+        CREATE CONSTRAINT {name} IF NOT EXISTS
+        FOR (n:{label}) REQUIRE ({', '.join(f"n.{prop}" for prop in keys)}) IS UNIQUE
+        """
+    for label, indexes in NODE_INDEXES.items():
+        for keys in indexes:
+            name = '_'.join((label.lower(), *keys))
+            commands[f"index_{label}_{'_'.join(keys)}"] = f"""
+            CREATE INDEX {name} IF NOT EXISTS
+            FOR (n:{label}) ON ({', '.join(f"n.{prop}" for prop in keys)})
+            """
+    for label in SEARCH_LABELS:
+        commands[f"text_index_{label}_{SEARCH_PROPERTY}"] = f"""
+        CREATE TEXT INDEX {label.lower()}_{SEARCH_PROPERTY} IF NOT EXISTS
+        FOR (n:{label}) ON (n.{SEARCH_PROPERTY})
+        """
+        commands[f"fulltext_index_{label}_{SEARCH_PROPERTY}"] = f"""
+        CREATE FULLTEXT INDEX {label.lower()}_{SEARCH_PROPERTY}_fulltext IF NOT EXISTS
+        FOR (n:{label}) ON EACH [n.{SEARCH_PROPERTY}]
+        """
+    for rel_type, properties in RELATIONSHIP_INDEXES.items():
+        for prop in properties:
+            commands[f"index_{rel_type}_{prop}"] = f"""
+            CREATE INDEX {rel_type.lower()}_{prop} IF NOT EXISTS
+            FOR ()-[r:{rel_type}]-() ON (r.{prop})
+            """
+    commands['await_indexes'] = f"CALL db.awaitIndexes({timeout})"
+
+    with driver.session() as session:
+        for name, command in commands.items():
+            with measure(metrics, 'schema', name) as record:
+                summary = session.run(command).consume()
+                record.update(summary_counters(summary))
+    indexes = sum(len(properties) for properties in RELATIONSHIP_INDEXES.values())
+    node_indexes = sum(len(keys) for keys in NODE_INDEXES.values())
+    print(f"Schema ready: {len(CONSTRAINTS)} constraints, {node_indexes} node indexes, {2 * len(SEARCH_LABELS)} search indexes and {indexes} relationship indexes online.")
+
 
+def run_migration(driver, migration, batch_size=DEFAULT_BATCH_SIZE, metrics=None):
+    """ Run a migration of MIGRATIONS in batches, one managed transaction per batch.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        migration: Name of the migration.
+        batch_size: Maximum number of elements updated per transaction.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the steps.
     """
-    MATCH (a:AreaAtuacao {codigo: 2}), 
-    (s:SetorEconomico {nome: 'Serviços'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s)
-    """,
+    with driver.session() as session:
+        for name, query in MIGRATIONS[migration].items():
+            with measure(metrics, 'migration', f"{migration}.{name}") as record:
+                batches = rows = 0
+                if '$batch_size' not in query:
+                    record.update(summary_counters(session.run(query).consume()))
+                while '$batch_size' in query:
+                    migrated = session.execute_write(lambda tx: tx.run(query, batch_size=batch_size).single()['rows'])
+                    if not migrated:
+                        break
+                    batches += 1
+                    rows += migrated
+                    print(f"{migration}.{name}: batch {batches} committed ({migrated} rows, {rows} in total)")
+                record.update({'rows_out': rows, 'batches': batches, 'batch_size': batch_size})
+            print(f"Migration step {migration}.{name} finished in {record['wall_s']:.1f}s.")
 
+
+def in_transactions(command, batch_size, skip=0):
+    """ Wrap the body of a LOAD CSV command in CALL { ... } IN TRANSACTIONS.
+
+    The rows are committed every batch_size rows, and the query returns one
+    status row per input row, so the progress can be followed batch by batch.
+    Commands without LOAD CSV are returned unchanged.
+
+    Args:
+        command: Cypher command.
+        batch_size: Number of rows per transaction.
+        skip: Number of rows committed by a previous run, skipped before the first batch.
     """
-    MATCH (a:AreaAtuacao {codigo: 3}),
-    (s:SetorEconomico {nome: 'Serviços'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s)
-    """,
-
-    """
-    MATCH (a:AreaAtuacao {codigo: 4}),
-    (s1:SetorEconomico {nome: 'Serviços'}),
-    (s2:SetorEconomico {nome: 'Comércio'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s1)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s2)
-    """,
-
-    """
-    MATCH (a:AreaAtuacao {codigo: 5}),
-    (s1:SetorEconomico {nome: 'Serviços'}),
-    (s2:SetorEconomico {nome: 'Comércio'}),
-    (s3:SetorEconomico {nome: 'Indústria'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s1)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s2)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s3)
-    """,
-
-    """
-    MATCH (a:AreaAtuacao {codigo: 6}),
-    (s1:SetorEconomico {nome: 'Serviços'}),
-    (s2:SetorEconomico {nome: 'Comércio'}),
-    (s3:SetorEconomico {nome: 'Indústria'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s1)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s2)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s3)
-    """,
-
-    """
-    MATCH (a:AreaAtuacao {codigo: 7}),
-    (s1:SetorEconomico {nome: 'Agropecuária'}),
-    (s2:SetorEconomico {nome: 'Indústria'}),
-    (s3:SetorEconomico {nome: 'Construção'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s1)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s2)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s3)
-    """,
-
-    """
-    MATCH (a:AreaAtuacao {codigo: 8}),
-    (s1:SetorEconomico {nome: 'Agropecuária'}),
-    (s2:SetorEconomico {nome: 'Indústria'}),
-    (s3:SetorEconomico {nome: 'Serviços'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s1)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s2)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s3)
-    """,
-
-    """
-    MATCH (a:AreaAtuacao {codigo: 9}),
-    (s:SetorEconomico {nome: 'Serviços'})
+    match = LOAD_CSV.match(command)
+    if match is None:
+        return command
+    load, row, body = match.groups()
+    resume = f"\n    WITH {row} SKIP {int(skip)}" if skip else ""
+    return f"""{load.rstrip()}{resume}
+    CALL {{
+    WITH {row}
+    {body.strip()}
+    }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+    ON ERROR BREAK
+    REPORT STATUS AS s
+    RETURN s.transactionId AS tx, s.committed AS committed, s.errorMessage AS error
+    """
+
+
+def run_command(driver, name, command, batch_size=None, metrics=None, fingerprint=None, done=0):
+    """ Run one load command, in batches when it reads a CSV file, and report the progress of each batch.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        name: Name of the command.
+        command: Cypher command.
+        batch_size: Number of rows per transaction, or None to run the command in a single transaction.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the command.
+        fingerprint: Fingerprint returned by step_fingerprint, or None to not checkpoint the batches.
+        done: Number of batches committed by a previous run, which are skipped.
+    """
+    query = in_transactions(command, batch_size, done * (batch_size or 0)) if batch_size else command
+    batched = query is not command
+
+    def batch_committed():
+        print(f"{name}: batch {batches} committed ({batch_rows} rows, {rows} in total)")
+        # The status rows stream on this session, so the checkpoint is written on another one
+        if fingerprint is not None:
+            save_checkpoint(driver, name, fingerprint, batches)
+
+    with measure(metrics, 'load', name) as record, driver.session() as session:
+        result = session.run(query)
+
+        # The status rows arrive in input order, one transaction after the other
+        batches = done
+        rows = batch_rows = 0
+        current = error = None
+        for status in (result if batched else []):
+            if status['tx'] != current and batch_rows:
+                batches += 1
+                batch_committed()
+                batch_rows = 0
+            current = status['tx']
+            if not status['committed']:
+                error = error or status['error']
+                continue
+            rows += 1
+            batch_rows += 1
+        if batch_rows:
+            batches += 1
+            batch_committed()
+
+        record.update(summary_counters(result.consume()))
+        if batched:
+            record.update({'rows_in': rows, 'batches': batches, 'batch_size': batch_size})
+        if error is not None:
+            raise RuntimeError(f"Command {name} stopped after {batches} committed batches ({rows} rows): {error}")
+
+    print(f"Command {name} executed successfully in {record['wall_s']:.1f}s.")
+
+
+def save_checkpoint(driver, step, fingerprint, batches, completed=False):
+    """ Record the batches committed by a load step or partition in its LoadCheckpoint node.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        step: Name of the step or partition.
+        fingerprint: Fingerprint returned by step_fingerprint.
+        batches: Number of batches committed so far.
+        completed: Boolean to mark the step as finished.
+    """
+    driver.execute_query(SAVE_CHECKPOINT, step=step, fingerprint=fingerprint, batches=batches, completed=completed)
+
+
+def read_checkpoints(driver):
+    """ Read the checkpoints left by an interrupted load, by step or partition name.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+    """
+    records, _, _ = driver.execute_query(READ_CHECKPOINTS)
+    return {record['step']: record.data() for record in records}
+
+
+def resume_point(checkpoints, name, fingerprint):
+    """ Return the number of batches of a step or partition already committed, and whether it finished.
+
+    A checkpoint of another fingerprint was cut from other rows or batch
+    sizes, so the step starts over; its MERGEs make that harmless. A step
+    without fingerprint always starts over.
+
+    Args:
+        checkpoints: Dictionary returned by read_checkpoints.
+        name: Name of the step or partition.
+        fingerprint: Fingerprint returned by step_fingerprint.
+    """
+    checkpoint = checkpoints.get(name)
+    if fingerprint is None or checkpoint is None or checkpoint['fingerprint'] != fingerprint:
+        return 0, False
+    return checkpoint['batches'] or 0, bool(checkpoint['completed'])
+
+
+def step_fingerprint(step, batch_size, input_dir=None):
+    """ Fingerprint the query, batch size and rows of a load step.
+
+    The rows of a LOAD CSV step are the files it reads, hashed from the local
+    copies in input_dir. When a file cannot be hashed the step has no
+    fingerprint: resuming it with SKIP could skip rows of another version of
+    the file, so it is never resumed.
+
+    Args:
+        step: Load step.
+        batch_size: Number of rows per transaction.
+        input_dir: Path to the directory with the processed CSV files read by the LOAD CSV steps.
+
+    Returns:
+        The fingerprint, or None when the files of a LOAD CSV step cannot be hashed.
+    """
+    digest = hashlib.sha256(f"{step['query']}\n{batch_size}".encode('utf-8'))
+    if 'rows' in step:
+        digest.update(step['rows'].to_csv(index=False).encode('utf-8'))
+        return digest.hexdigest()
+
+    for file_name in step['inputs']:
+        path = os.path.join(input_dir, file_name) if input_dir is not None else None
+        if path is None or not os.path.exists(path):
+            return None
+        digest.update(file_hash(path).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_frames(input_dir):
+    """ Read the processed tables saved by process_datasets.py.
+
+    Args:
+        input_dir: Path to the directory with the processed CSV files.
+    """
+    return {
+        table: pd.read_csv(os.path.join(input_dir, f"{table}.csv"), sep=';', dtype=SCHEMAS[table])
+        for table in TABLES
+    }
+
+
+def select_years(frames, years):
+    """ Keep only the rows of the given years in every processed table.
+
+    Planning the load from these rows touches only the nodes and edges of
+    those years, so a yearly refresh costs one year of data.
+
+    Args:
+        frames: Dictionary with the processed DataFrames, by table name.
+        years: List of years.
+    """
+    return {table: df[df[YEAR_COLUMNS[table]].isin(years)] for table, df in frames.items()}
+
+
+def to_rows(df, columns):
+    """ Convert the columns of a DataFrame to a list of dictionaries with Python values.
+
+    float32 values are converted through their shortest text form, so 94.8
+    is sent as 94.8 and not as 94.80000305175781, and missing values are sent as null.
+
+    Args:
+        df: DataFrame with the columns.
+        columns: List of column names.
+    """
+    df = df[columns].copy()
+    for column in df.columns[df.dtypes == 'float32']:
+        df[column] = pd.to_numeric(df[column].astype(str), errors='coerce')
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def node_step(label, spec, frames):
+    """ Describe the first-phase step that merges one node set from its distinct keys.
+
+    Args:
+        label: Node label.
+        spec: Entry of NODES.
+        frames: Dictionary with the processed DataFrames, by table name.
+    """
+    df = frames[spec['table']]
+    key, key_column = spec['key']
+    columns = {key: key_column, **spec['properties']}
+    if 'search' in spec:
+        columns[SEARCH_PROPERTY] = spec['search']
+
+    nodes = df[list(columns.values())].dropna(subset=[key_column]).drop_duplicates(subset=[key_column])
+    nodes.columns = list(columns)
+
+    updates = ', '.join(f"n.{name} = row.{name}" for name in spec['properties'])
+    query = f"""
+    UNWIND $rows AS row
+    MERGE (n:{label} {{{key}: row.{key}}})
+    {f"ON CREATE SET {updates}" if updates else ""}
+    {f"SET n.{SEARCH_PROPERTY} = row.{SEARCH_PROPERTY}" if 'search' in spec else ""}
+    """
+    return {
+        'phase': 1, 'name': f"nodes_{label}", 'rows_in': len(df), 'rows': nodes, 'query': query,
+        'inputs': [spec['table']], 'deps': []
+    }
+
+
+def edge_step(name, spec, frames):
+    """ Describe the second-phase step that merges one relationship set from its distinct edges.
+
+    Args:
+        name: Name of the step.
+        spec: Entry of EDGES.
+        frames: Dictionary with the processed DataFrames, by table name.
+    """
+    df = frames[spec['table']]
+    (source_label, source_column), (target_label, target_column) = spec['source'], spec['target']
+    columns = {'source': source_column, 'target': target_column, **spec['properties']}
+
+    edges = df[list(columns.values())].dropna(subset=[source_column, target_column])
+    edges.columns = list(columns)
+
+    # As with one SET per input row, the last row of each relationship wins
+    merge_on = spec.get('merge_on', list(spec['properties']))
+    edges = edges.drop_duplicates(subset=['source', 'target', *merge_on], keep='last')
+
+    properties = ', '.join(f"{prop}: row.{prop}" for prop in merge_on)
+    updates = ', '.join(f"r.{prop} = row.{prop}" for prop in spec['properties'] if prop not in merge_on)
+    query = f"""
+    UNWIND $rows AS row
+    MATCH (a:{source_label} {{{NODES[source_label]['key'][0]}: row.source}})
+    MATCH (b:{target_label} {{{NODES[target_label]['key'][0]}: row.target}})
+    MERGE (a)-[r:{spec['type']}{f" {{{properties}}}" if properties else ""}]->(b)
+    {f"SET {updates}" if updates else ""}
+    """
+    step = {
+        'phase': 2, 'name': name, 'rows_in': len(df), 'rows': edges, 'query': query,
+        'inputs': [spec['table']], 'deps': [f"nodes_{source_label}", f"nodes_{target_label}"]
+    }
+    if 'partition' in spec:
+        step['partitions'] = df.loc[edges.index, spec['partition']]
+    return step
+
+
+def emprego_step(frames):
+    """ Describe the second-phase step that merges the Emprego nodes and links them to their municipality.
+
+    Args:
+        frames: Dictionary with the processed DataFrames, by table name.
+    """
+    df = frames[EMPREGO['table']]
+    columns = {**EMPREGO['key'], **EMPREGO['properties']}
+
+    rows = df[list(columns.values())].dropna(subset=list(EMPREGO['key'].values()))
+    rows.columns = list(columns)
+    rows = rows.drop_duplicates(subset=list(EMPREGO['key']), keep='last')
+
+    key = ', '.join(f"{prop}: row.{prop}" for prop in EMPREGO['key'])
+    updates = ', '.join(f"e.{prop} = row.{prop}" for prop in EMPREGO['properties'])
+    query = f"""
+    UNWIND $rows AS row
+    MATCH (m:Municipio {{codigo: row.municipio}})
+    MERGE (e:Emprego {{{key}}})
+    SET {updates}
+    MERGE (e)-[:{EMPREGO['type']}]->(m)
+    """
+    return {
+        'phase': 2, 'name': 'emprego', 'rows_in': len(df), 'rows': rows, 'query': query,
+        'inputs': [EMPREGO['table']], 'deps': ['nodes_Municipio'],
+        'partitions': df.loc[rows.index, EMPREGO['partition']]
+    }
+
+
+def remuneracao_por_uf(df):
+    """ Pivot the RAIS Tabela 6 rows into one column of average remuneration per year, indexed by UF.
+
+    Args:
+        df: DataFrame with the rais_tabela6_joined table.
+    """
+    df = df.dropna(subset=['uf_sigla', 'media_remuneracao']).astype({'uf_sigla': str})
+    wide = df.drop_duplicates(['uf_sigla', 'ano'], keep='last').pivot(index='uf_sigla', columns='ano', values='media_remuneracao')
+    wide.columns = [f"{REMUNERACAO_PREFIX}{ano}" for ano in wide.columns]
+    return wide
+
+
+def remuneracao_step(frames):
+    """ Describe the second-phase step that sets the yearly average remuneration on each UF node.
+
+    Args:
+        frames: Dictionary with the processed DataFrames, by table name.
+    """
+    df = frames['rais_tabela6_joined']
+    wide = remuneracao_por_uf(df)
+    rows = pd.DataFrame({
+        'sigla': wide.index,
+        'remuneracao': [values.dropna().to_dict() for _, values in wide.iterrows()]
+    })
+    query = """
+    UNWIND $rows AS row
+    MATCH (u:UnidadeFederativa {sigla: row.sigla})
+    SET u += row.remuneracao
+    """
+    return {
+        'phase': 2, 'name': 'remuneracao_uf', 'rows_in': len(df), 'rows': rows, 'query': query,
+        'inputs': ['rais_tabela6_joined'], 'deps': ['nodes_UnidadeFederativa']
+    }
+
+
+def area_setores_step(deps=('nodes_AreaAtuacao', 'nodes_SetorEconomico')):
+    """ Describe the step that relates every area of study to its economic sectors, from AREA_SETORES.
+
+    Both loaders run it once the areas and sectors exist.
+
+    Args:
+        deps: Names of the steps that create the AreaAtuacao and SetorEconomico nodes.
+    """
+    rows = pd.DataFrame(
+        [(area, setor) for area, setores in AREA_SETORES.items() for setor in setores],
+        columns=['area', 'setor']
+    )
+    query = """
+    UNWIND $rows AS row
+    MATCH (a:AreaAtuacao {codigo: row.area})
+    MATCH (s:SetorEconomico {nome: row.setor})
     MERGE (a)-[:ESTA_RELACIONADO_A]->(s)
-    """,
+    """
+    return {'phase': 2, 'name': 'area_setores', 'rows_in': len(rows), 'rows': rows, 'query': query, 'inputs': [], 'deps': list(deps)}
+
+
+def command_steps():
+    """ Describe the steps of the LOAD CSV loader: the COMMANDS, then the area to sector mapping.
+    """
+    steps = [{'name': name, **spec} for name, spec in COMMANDS.items()]
+    steps.append(area_setores_step(deps=['indicadores', 'municipios_setores']))
+    return steps
+
+
+def plan_load(frames):
+    """ Plan the UNWIND load in two phases: every node set, then every relationship set.
+
+    Each node and each edge is merged once, from keys deduplicated here, and
+    the relationship MERGEs only look nodes up through the constraint indexes.
+
+    Args:
+        frames: Dictionary with the processed DataFrames, by table name.
+
+    Returns:
+        The list of steps, in load order.
+    """
+    steps = [node_step(label, spec, frames) for label, spec in NODES.items()]
+    steps += [edge_step(name, spec, frames) for name, spec in EDGES.items()]
+    steps.append(emprego_step(frames))
+    steps.append(remuneracao_step(frames))
+    steps.append(area_setores_step())
+    return steps
+
+
+def print_load_plan(steps):
+    """ Print the MERGE operations issued by each step and phase, next to one MERGE per input row.
+
+    Args:
+        steps: List returned by plan_load.
+    """
+    print(f"{'phase':<6} {'step':<28} {'input rows':>12} {'merges':>10}")
+    for phase in (1, 2):
+        phase_steps = [step for step in steps if step['phase'] == phase]
+        for step in phase_steps:
+            print(f"{phase:<6} {step['name']:<28} {step['rows_in']:>12} {len(step['rows']):>10}")
+        merges = sum(len(step['rows']) for step in phase_steps)
+        per_row = sum(step['rows_in'] for step in phase_steps)
+        print(f"Phase {phase}: {merges} MERGE operations ({per_row} when merging once per input row)")
+
+
+def write_batches(session, name, query, rows, batch_size, report=True, fingerprint=None, done=0):
+    """ Write rows in UNWIND batches, one managed transaction per batch.
+
+    execute_write retries the batches that fail with a transient error, such as a deadlock.
+
+    Args:
+        session: Neo4j session.
+        name: Name shown in the progress messages and of the checkpoint.
+        query: Cypher query that reads the batch from $rows.
+        rows: List of dictionaries returned by to_rows.
+        batch_size: Number of rows per transaction.
+        report: Boolean to print a message after each batch.
+        fingerprint: Fingerprint returned by step_fingerprint, or None to not checkpoint the batches.
+        done: Number of batches committed by a previous run, which are skipped.
+
+    Returns:
+        A tuple with the summed result counters and the number of batches written.
+    """
+    def write(tx, batch, number):
+        summary = tx.run(query, rows=batch).consume()
+        # Committed with the batch, so the checkpoint never runs ahead of the data
+        if fingerprint is not None:
+            tx.run(SAVE_CHECKPOINT, step=name, fingerprint=fingerprint, batches=number, completed=False).consume()
+        return summary
+
+    totals = dict.fromkeys(SUMMARY_COUNTERS, 0)
+    batches = 0
+    for number, start in enumerate(range(done * batch_size, len(rows), batch_size), start=done + 1):
+        batch = rows[start:start + batch_size]
+        summary = session.execute_write(write, batch, number)
+        for key in SUMMARY_COUNTERS:
+            totals[key] += getattr(summary.counters, key)
+        batches += 1
+        if report:
+            print(f"{name}: batch {number} committed ({len(batch)} rows, {start + len(batch)} in total)")
+    return totals, batches
+
+
+def run_unwind(driver, step, batch_size, metrics=None, fingerprint=None, done=0):
+    """ Send the rows of a load step in UNWIND batches, one managed transaction per batch.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        step: Step returned by plan_load.
+        batch_size: Number of rows per transaction.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the step.
+        fingerprint: Fingerprint returned by step_fingerprint, or None to not checkpoint the batches.
+        done: Number of batches committed by a previous run, which are skipped.
+    """
+    name = step['name']
+    rows = to_rows(step['rows'], list(step['rows'].columns))
+
+    with measure(metrics, 'load', name, rows_in=step['rows_in']) as record, driver.session() as session:
+        totals, batches = write_batches(session, name, step['query'], rows, batch_size, fingerprint=fingerprint, done=done)
+        record.update(totals)
+        record.update({'rows_out': len(rows), 'phase': step['phase'], 'batches': batches, 'batch_size': batch_size})
 
+    print(f"Step {name} executed successfully in {record['wall_s']:.1f}s.")
+
+
+def write_partition(driver, name, query, rows, batch_size, fingerprint=None, done=0):
+    """ Write one partition of a load step on its own session.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        name: Name of the partition.
+        query: Cypher query that reads the batch from $rows.
+        rows: List of dictionaries returned by to_rows.
+        batch_size: Number of rows per transaction.
+        fingerprint: Fingerprint returned by step_fingerprint, or None to not checkpoint the batches.
+        done: Number of batches committed by a previous run, which are skipped.
     """
-    MATCH (a:AreaAtuacao {codigo: 10}),
-    (s1:SetorEconomico {nome: 'Serviços'}),
-    (s2:SetorEconomico {nome: 'Comércio'})
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s1)
-    MERGE (a)-[:ESTA_RELACIONADO_A]->(s2)
+    start = time.perf_counter()
+    with driver.session() as session:
+        totals, batches = write_batches(session, name, query, rows, batch_size, report=False, fingerprint=fingerprint, done=done)
+    elapsed = time.perf_counter() - start
+    written = max(len(rows) - done * batch_size, 0)
+    # A single write, so the lines of concurrent partitions do not interleave
+    print(f"{name}: {written} edges in {batches} batches, {written / elapsed if elapsed else 0:.0f} edges/s\n", end='')
+    return totals, batches
+
+
+def run_unwind_parallel(driver, step, batch_size, workers, metrics=None, fingerprint=None, checkpoints=None):
+    """ Write the partitions of a relationship step concurrently, one session per partition.
+
+    The partitions never share a municipality. Other nodes, such as the
+    Curso nodes of TRAJETORIA_DO_CURSO, can be shared, so locks on them can
+    still conflict; the deadlocks this causes are retried by execute_write.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        step: Step returned by plan_load, with partitions.
+        batch_size: Number of rows per transaction.
+        workers: Number of threads, each one writing a partition at a time.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the step.
+        fingerprint: Fingerprint returned by step_fingerprint, or None to not checkpoint the batches.
+        checkpoints: Dictionary returned by read_checkpoints, to resume each partition where it stopped.
     """
+    name = step['name']
+    partitions = [
+        (f"{name}[{key}]", to_rows(rows, list(rows.columns)))
+        for key, rows in step['rows'].groupby(step['partitions'].to_numpy(), observed=True, sort=False)
     ]
+    # Start with the largest partitions, so the pool finishes at about the same time
+    partitions.sort(key=lambda partition: len(partition[1]), reverse=True)
+
+    with measure(metrics, 'load', name, rows_in=step['rows_in']) as record:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    write_partition, driver, partition, step['query'], rows, batch_size,
+                    fingerprint, resume_point(checkpoints or {}, partition, fingerprint)[0]
+                )
+                for partition, rows in partitions
+            ]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+        record.update({key: sum(totals[key] for totals, _ in results) for key in SUMMARY_COUNTERS})
+        record.update({
+            'rows_out': len(step['rows']),
+            'phase': step['phase'],
+            'batches': sum(batches for _, batches in results),
+            'batch_size': batch_size,
+            'workers': workers,
+            'partitions': len(partitions),
+            'edges_per_s': round(len(step['rows']) / elapsed, 1) if elapsed else None
+        })
+
+    print(f"Step {name} executed successfully in {record['wall_s']:.1f}s with {workers} workers: {record['edges_per_s']} edges/s.")
+
+
+def order_steps(steps):
+    """ Sort the load steps so each one runs after the steps it depends on.
+
+    Steps keep their declared order whenever their dependencies allow it.
+
+    Args:
+        steps: List of load steps, each one with a name and the list of names in deps.
+    """
+    names = {step['name'] for step in steps}
+    for step in steps:
+        unknown = set(step['deps']) - names
+        if unknown:
+            raise ValueError(f"Step {step['name']} depends on unknown steps: {', '.join(sorted(unknown))}")
+
+    ordered, done = [], set()
+    pending = list(steps)
+    while pending:
+        ready = next((step for step in pending if set(step['deps']) <= done), None)
+        if ready is None:
+            raise ValueError(f"Circular dependencies between the steps: {', '.join(step['name'] for step in pending)}")
+        pending.remove(ready)
+        ordered.append(ready)
+        done.add(ready['name'])
+    return ordered
+
+
+def plan_lines(plan, depth=0):
+    """ Format a query plan returned by EXPLAIN as an indented tree, one operator per line.
+
+    Args:
+        plan: Plan dictionary of the result summary.
+        depth: Depth of the operator in the tree.
+    """
+    arguments = plan.get('args', {})
+    details = f" {arguments['Details']}" if arguments.get('Details') else ""
+    estimated = f" (~{arguments['EstimatedRows']:.0f} rows)" if 'EstimatedRows' in arguments else ""
+    lines = [f"{'  ' * depth}+{plan['operatorType']}{details}{estimated}"]
+    for child in plan.get('children', []):
+        lines += plan_lines(child, depth + 1)
+    return lines
+
 
-    for command in commands:
-        with driver.session() as session:
-            session.run(command)
-            print("Command executed successfully.")
+def explain_step(driver, step, batch_size):
+    """ Print the EXPLAIN plan of the statement a load step runs, without running it.
 
+    Args:
+        driver: Neo4j driver to connect to the database.
+        step: Load step.
+        batch_size: Number of rows per transaction.
+    """
+    if 'rows' in step:
+        query, parameters = step['query'], {'rows': to_rows(step['rows'].head(batch_size), list(step['rows'].columns))}
+    else:
+        query, parameters = in_transactions(step['query'], batch_size), {}
+
+    with driver.session() as session:
+        plan = session.run(f"EXPLAIN {query}", parameters).consume().plan
+
+    inputs = ', '.join(step['inputs']) or 'none'
+    deps = ', '.join(step['deps']) or 'none'
+    print(f"EXPLAIN {step['name']} (inputs: {inputs}; after: {deps})")
+    print('\n'.join(plan_lines(plan)))
 
-def main(create_bool):
+
+def run_load(driver, steps, batch_sizes, workers=1, metrics=None, explain=False, input_dir=None):
+    """ Run the load steps in dependency order, resuming an interrupted load from its checkpoints.
+
+    Every committed batch and finished step is recorded in a LoadCheckpoint
+    node, so a rerun skips the finished steps and continues each unfinished
+    one from its first uncommitted batch. The checkpoints are removed when
+    the whole load succeeds.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        steps: List of load steps, from plan_load or command_steps.
+        batch_sizes: Dictionary with the rows per transaction of each step.
+        workers: Number of threads writing the partitioned steps with rows.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the steps.
+        explain: Boolean to print the EXPLAIN plan of each statement before it runs.
+        input_dir: Path to the directory with the processed CSV files read by the LOAD CSV steps.
+    """
+    checkpoints = read_checkpoints(driver)
+
+    for step in order_steps(steps):
+        name = step['name']
+        batch_size = batch_sizes[name]
+        fingerprint = step_fingerprint(step, batch_size, input_dir)
+        done, completed = resume_point(checkpoints, name, fingerprint)
+        if fingerprint is None:
+            print(f"Step {name}: {', '.join(step['inputs'])} not found in {input_dir}, so an interrupted run starts it over.")
+        if completed:
+            print(f"Step {name} already completed, skipped.")
+            continue
+        if done:
+            print(f"Step {name} resumes after {done} committed batches.")
+
+        if explain:
+            explain_step(driver, step, batch_size)
+
+        if 'rows' not in step:
+            run_command(driver, name, step['query'], batch_size, metrics, fingerprint, done)
+        elif workers > 1 and 'partitions' in step:
+            run_unwind_parallel(driver, step, batch_size, workers, metrics, fingerprint, checkpoints)
+        else:
+            run_unwind(driver, step, batch_size, metrics, fingerprint, done)
+        if fingerprint is not None:
+            save_checkpoint(driver, name, fingerprint, done, completed=True)
+
+    driver.execute_query(CLEAR_CHECKPOINTS)
+
+
+def create_and_fill_database(driver, metrics=None, batch_sizes=None, loader='csv', frames=None, workers=1, explain=False, restart=False, input_dir=None):
+    """ Create the Neo4j database and schema.
+
+    Each LOAD CSV command commits its rows in batches, so memory stays flat
+    as the files grow and a failed load keeps the batches already committed.
+    A rerun after a failure resumes from the checkpoints of those batches.
+
+    Args:
+        driver: Neo4j driver to connect to the database.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the commands.
+        batch_sizes: Dictionary with the rows per transaction of each command, overriding BATCH_SIZES.
+            The key None sets the size of every command not listed.
+        loader: 'csv' to read the files from the Neo4j import directory with LOAD CSV,
+            'unwind' to send the rows of frames from this process, nodes first and then relationships.
+        frames: Dictionary with the processed DataFrames by table name (see TABLES), used by the 'unwind' loader.
+        workers: Number of threads writing the partitioned relationship steps of the 'unwind' loader.
+        explain: Boolean to print the EXPLAIN plan of each load statement before it runs.
+        restart: Boolean to discard the checkpoints of an interrupted load and run every step again.
+        input_dir: Path to the local copies of the files read by the 'csv' loader, hashed to decide whether
+            an interrupted command can resume.
+    """
+    create_schema(driver, metrics)
+    if restart:
+        driver.execute_query(CLEAR_CHECKPOINTS)
+
+    # A size given for every command replaces the per-command defaults
+    batch_sizes = dict(batch_sizes or {})
+    default_batch_size = batch_sizes.pop(None, None)
+    batch_sizes = {**(BATCH_SIZES if default_batch_size is None else {}), **batch_sizes}
+    default_batch_size = default_batch_size or DEFAULT_BATCH_SIZE
+
+    if loader == 'unwind':
+        steps = plan_load(frames)
+        print_load_plan(steps)
+    else:
+        steps = command_steps()
+
+    batch_sizes = {step['name']: batch_sizes.get(step['name'], default_batch_size) for step in steps}
+    run_load(driver, steps, batch_sizes, workers, metrics, explain, input_dir)
+
+
+def import_header(columns, types):
+    """ Add the neo4j-admin type of each property to its column name.
+
+    Args:
+        columns: List of property names.
+        types: Dictionary with the non-text types, by property name.
+    """
+    return [f"{column}:{types[column]}" if column in types else column for column in columns]
+
+
+def export_import_files(frames, output_dir):
+    """ Write the node and relationship files of neo4j-admin database import.
+
+    The files hold the same deduplicated node sets and edges as the UNWIND
+    loader, with one ID space per label. Edges whose nodes would not exist
+    are dropped, as the MATCH clauses of the Cypher load do, so the import
+    builds the same graph as LOAD CSV in a single offline pass.
+
+    Args:
+        frames: Dictionary with the processed DataFrames, by table name.
+        output_dir: Path to the directory where the files are saved.
+
+    Returns:
+        The neo4j-admin command that imports the files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    steps = {step['name']: step for step in plan_load(frames)}
+
+    ids = {}
+    arguments = []
+    for label, spec in NODES.items():
+        nodes = steps[f"nodes_{label}"]['rows']
+        key = spec['key'][0]
+        ids[label] = nodes[key]
+
+        types = IMPORT_TYPES.get(label, {})
+        if label == 'UnidadeFederativa':
+            wide = remuneracao_por_uf(frames['rais_tabela6_joined'])
+            nodes = nodes.merge(wide, left_on=key, right_index=True, how='left')
+            types = {**types, **dict.fromkeys(wide.columns, 'double')}
+
+        nodes = nodes.copy()
+        nodes.columns = import_header(nodes.columns, types)
+        nodes.insert(0, f":ID({label})", ids[label].to_numpy())
+
+        file_name = f"nodes_{label}.csv"
+        nodes.to_csv(os.path.join(output_dir, file_name), index=False, sep=';')
+        arguments.append(f"--nodes={label}={file_name}")
+
+    # The Emprego nodes of municipalities that are not loaded are not created either
+    emprego = steps['emprego']['rows']
+    emprego = emprego[emprego['municipio'].isin(ids['Municipio'])]
+    ids['Emprego'] = emprego[list(EMPREGO['key'])].astype(str).agg('|'.join, axis=1)
+    nodes = emprego.copy()
+    nodes.columns = import_header(nodes.columns, IMPORT_TYPES['Emprego'])
+    nodes.insert(0, ":ID(Emprego)", ids['Emprego'].to_numpy())
+    nodes.to_csv(os.path.join(output_dir, "nodes_Emprego.csv"), index=False, sep=';')
+    arguments.append("--nodes=Emprego=nodes_Emprego.csv")
+
+    edge_sets = {name: (spec['type'], spec['source'][0], spec['target'][0], steps[name]['rows']) for name, spec in EDGES.items()}
+    edge_sets['emprego_municipio'] = (EMPREGO['type'], 'Emprego', 'Municipio', pd.DataFrame(
+        {'source': ids['Emprego'], 'target': emprego['municipio']}
+    ))
+    edge_sets['area_setor'] = ('ESTA_RELACIONADO_A', 'AreaAtuacao', 'SetorEconomico', steps['area_setores']['rows'].set_axis(['source', 'target'], axis=1))
+
+    for name, (rel_type, source, target, edges) in edge_sets.items():
+        edges = edges[edges['source'].isin(ids[source]) & edges['target'].isin(ids[target])].copy()
+        edges.columns = [f":START_ID({source})", f":END_ID({target})", *import_header(edges.columns[2:], IMPORT_TYPES.get(rel_type, {}))]
+
+        file_name = f"relationships_{name}.csv"
+        edges.to_csv(os.path.join(output_dir, file_name), index=False, sep=';')
+        arguments.append(f"--relationships={rel_type}={file_name}")
+
+    return " \\\n    ".join(["neo4j-admin database import full neo4j --overwrite-destination --delimiter=';' --array-delimiter='|'", *arguments])
+
+
+def parse_batch_sizes(values):
+    """ Parse the --batch-size arguments, either N for every command or NAME=N for one command.
+
+    Args:
+        values: List of strings.
+    """
+    batch_sizes = {}
+    for value in values or []:
+        name, _, size = value.rpartition('=')
+        batch_sizes[name or None] = int(size)
+    return batch_sizes
+
+
+def main(create_bool, metrics_file=None, schema_only=False, batch_sizes=None, loader='csv', input_dir='datasets', plan_only=False, workers=1, import_dir=None, years=None, migration=None, explain=False, restart=False):
     """ Main function to create the Neo4j database and schema.
 
     Args:
         create_bool: Boolean to create the graph database.
+        metrics_file: Path to a JSON-lines file where the timings and counters of each command are appended, or None.
+        schema_only: Boolean to only create the constraints and indexes, without loading any data.
+        batch_sizes: Dictionary with the rows per transaction of each command, the key None for every command.
+        loader: 'csv' to load with LOAD CSV, 'unwind' to send the rows of the processed files over Bolt.
+        input_dir: Path to the directory with the processed CSV files, read by the 'unwind' loader and hashed by the 'csv' loader.
+        plan_only: Boolean to only print the MERGE operations of each phase of the 'unwind' loader.
+        workers: Number of threads writing the partitioned relationship steps of the 'unwind' loader.
+        import_dir: Path to a directory where the neo4j-admin import files are written instead of loading the database.
+        years: List of years to load incrementally with the 'unwind' loader, or None to load every year.
+        migration: Name of a migration of MIGRATIONS to run on the existing database instead of loading it.
+        explain: Boolean to print the EXPLAIN plan of each load statement before it runs.
+        restart: Boolean to discard the checkpoints of an interrupted load and run every step again.
     """
+    if years is not None and loader != 'unwind' and not plan_only:
+        raise ValueError("Loading selected years requires the unwind loader (--loader unwind)")
+
+    if plan_only:
+        frames = read_frames(input_dir)
+        print_load_plan(plan_load(frames if years is None else select_years(frames, years)))
+        return
+
+    if import_dir is not None:
+        command = export_import_files(read_frames(input_dir), import_dir)
+        print(f"Import files saved to {import_dir}. Stop the database and, from that directory, run:\n{command}")
+        print("Then start it and run this script with --schema-only to create the constraints and indexes.")
+        return
 
     URL = "bolt://localhost:7687" # Replace with your Neo4j database URL
     auth = ("neo4j", "12345678")  # Replace with your Neo4j username and password
@@ -194,8 +1253,19 @@ def main(create_bool):
         auth = auth
     )
     
-    if create_bool == "True":
-        create_and_fill_database(driver)
+    metrics = open_metrics(metrics_file, 'create_and_fill_database')
+    if migration is not None:
+        batch_sizes = dict(batch_sizes or {})
+        # The MERGEs of a migration find the nodes it creates through the new constraints
+        create_schema(driver, metrics)
+        run_migration(driver, migration, batch_sizes.get(None, DEFAULT_BATCH_SIZE), metrics)
+    elif schema_only:
+        create_schema(driver, metrics)
+    elif create_bool == "True":
+        frames = read_frames(input_dir) if loader == 'unwind' else None
+        if years is not None:
+            frames = select_years(frames, years)
+        create_and_fill_database(driver, metrics, batch_sizes, loader, frames, workers, explain, restart, input_dir)
     
     driver.close()
     
@@ -210,9 +1280,96 @@ if __name__ == "__main__":
         default=False,
         help="Create the Neo4j database and tables."
     )
+    parser.add_argument(
+        "--metrics",
+        "-m",
+        default=None,
+        help="Append the wall time and result counters of each command to this JSON-lines file."
+    )
+    parser.add_argument(
+        "--schema-only",
+        "-s",
+        action="store_true",
+        help="Only create the constraints and indexes, without loading any data."
+    )
+    parser.add_argument(
+        "--batch-size",
+        "-b",
+        nargs="+",
+        default=None,
+        help="Rows per transaction of the load commands: N for every command, or NAME=N for one command (e.g. indicadores=200)."
+    )
+    parser.add_argument(
+        "--loader",
+        "-l",
+        choices=LOADERS,
+        default="csv",
+        help="csv: LOAD CSV from the Neo4j import directory. unwind: send the rows of the processed files in UNWIND batches."
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        default="datasets",
+        help="Directory with the processed CSV files, read by the unwind loader. The csv loader hashes them to resume an interrupted load."
+    )
+    parser.add_argument(
+        "--plan",
+        "-p",
+        action="store_true",
+        help="Only print how many MERGE operations each phase of the unwind loader issues."
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=1,
+        help="Threads writing the TRAJETORIA_DO_CURSO and Emprego partitions (one per UF) with the unwind loader."
+    )
+    parser.add_argument(
+        "--export-import",
+        "-e",
+        default=None,
+        help="Write node and relationship files for neo4j-admin database import to this directory, instead of loading the database."
+    )
+    parser.add_argument(
+        "--year",
+        "-y",
+        nargs="+",
+        type=int,
+        default=None,
+        help="Load only this year, or the range between two years (e.g. 2022 2024), with the unwind loader."
+    )
+    parser.add_argument(
+        "--migrate",
+        choices=list(MIGRATIONS),
+        default=None,
+        help="Run this one-off migration on the existing database, in batches of --batch-size elements."
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Print the EXPLAIN plan of every load statement before it runs."
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard the checkpoints of an interrupted load and run every step from the start."
+    )
     args = parser.parse_args()
     create_bool = args.create
-    main(create_bool)
+    metrics_file = args.metrics
+    schema_only = args.schema_only
+    batch_sizes = parse_batch_sizes(args.batch_size)
+    loader = args.loader
+    input_dir = args.input
+    plan_only = args.plan
+    workers = args.workers
+    import_dir = args.export_import
+    years = list(range(min(args.year), max(args.year) + 1)) if args.year else None
+    migration = args.migrate
+    explain = args.explain
+    restart = args.restart
+    main(create_bool, metrics_file, schema_only, batch_sizes, loader, input_dir, plan_only, workers, import_dir, years, migration, explain, restart)
 
 
 
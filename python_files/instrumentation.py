@@ -0,0 +1,137 @@
+import json
+import os
+import resource
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# Counters of the Neo4j result summary recorded for each command and query
+SUMMARY_COUNTERS = [
+    'nodes_created', 'nodes_deleted', 'relationships_created', 'relationships_deleted', 'properties_set',
+    'labels_added', 'labels_removed', 'indexes_added', 'indexes_removed', 'constraints_added', 'constraints_removed'
+]
+
+# Records being measured in this process, innermost last
+_current = []
+
+
+def reset_peak_rss():
+    """ Reset the peak resident set size of this process, where the OS allows it (Linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """ Return the peak resident set size of this process in MiB.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and in bytes on macOS, and cannot be reset
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 if os.uname().sysname == 'Linux' else maxrss / (1024 * 1024)
+
+
+def open_metrics(metrics_file, script):
+    """ Start recording the metrics of one run, or return None when metrics_file is None.
+
+    Args:
+        metrics_file: Path to the JSON-lines file the records are appended to, or None.
+        script: Name of the script that produces the records.
+    """
+    if metrics_file is None:
+        return None
+    return {
+        'file': metrics_file,
+        'run_id': f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}",
+        'script': script
+    }
+
+
+def write_record(metrics, record):
+    """ Append one record to the metrics file. Does nothing when metrics is None.
+
+    Args:
+        metrics: Dictionary returned by open_metrics, or None.
+        record: Dictionary returned by measure.
+    """
+    if metrics is None:
+        return
+    line = {'run_id': metrics['run_id'], 'script': metrics['script'], **record}
+    with open(metrics['file'], 'a', encoding='utf-8') as f:
+        f.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+
+@contextmanager
+def measure(metrics, kind, name, rows_in=None):
+    """ Measure the wall time and peak memory of the enclosed block.
+
+    The block receives the record and can fill rows_in, rows_out or any
+    other field; count_rows does the same from inside the called functions.
+    The record is written to the metrics file when the block ends, failed or not.
+
+    Args:
+        metrics: Dictionary returned by open_metrics, or None to only measure.
+        kind: Kind of work measured ('stage', 'load' or 'query').
+        name: Name of the stage, command or query.
+        rows_in: Number of rows read, when known beforehand.
+    """
+    record = {
+        'kind': kind,
+        'name': name,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'status': 'ok',
+        'wall_s': None,
+        'rows_in': rows_in,
+        'rows_out': None,
+        'peak_rss_mb': None
+    }
+    reset_peak_rss()
+    start = time.perf_counter()
+    _current.append(record)
+    try:
+        yield record
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        _current.remove(record)
+        record['wall_s'] = round(time.perf_counter() - start, 3)
+        record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        write_record(metrics, record)
+
+
+def count_rows(rows_in=None, rows_out=None):
+    """ Add rows to the record being measured in this process, if any.
+
+    Args:
+        rows_in: Number of rows read.
+        rows_out: Number of rows written.
+    """
+    if not _current:
+        return
+    record = _current[-1]
+    for key, value in (('rows_in', rows_in), ('rows_out', rows_out)):
+        if value is not None:
+            record[key] = (record[key] or 0) + int(value)
+
+
+def summary_counters(summary):
+    """ Extract the update counters and timings of a Neo4j result summary.
+
+    Args:
+        summary: ResultSummary returned by Result.consume.
+    """
+    counters = {name: getattr(summary.counters, name) for name in SUMMARY_COUNTERS}
+    counters['result_available_after_ms'] = summary.result_available_after
+    counters['result_consumed_after_ms'] = summary.result_consumed_after
+    return counters
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from instrumentation import measure, write_record
+
+MANIFEST_NAME = 'pipeline_manifest.json'
+
+
+def file_hash(path):
+    """ Compute the SHA-256 hash of a file's content.
+
+    Args:
+        path: Path to the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_stage(name, func, args=(), inputs=(), deps=(), outputs=(), cache=None, load=None, code=None, options=None):
+    """ Describe one stage of the pipeline.
+
+    The stage runs as func(*args, **options), or as
+    func(dep_results, *args, **options) when it has dependencies, where
+    dep_results is the list of values returned by the stages listed in deps,
+    in order.
+
+    Args:
+        name: Name of the stage.
+        func: Module level function that runs the stage.
+        args: Positional arguments passed to func, after the dependency results if any.
+        inputs: Paths of the files read by the stage.
+        deps: Names of the stages whose results are passed to func.
+        outputs: Paths of the final files written by the stage.
+        cache: Function without arguments that returns the path of the result saved by a previous run, or None.
+        load: Function that loads the saved result from the path returned by cache.
+        code: Version of the code that implements the stage.
+        options: Keyword arguments passed to func that change how it runs but not its result
+            (e.g. a chunk size), left out of the fingerprint.
+    """
+    return {
+        'name': name,
+        'func': func,
+        'args': tuple(args),
+        'inputs': list(inputs),
+        'deps': list(deps),
+        'outputs': list(outputs),
+        'cache': cache,
+        'load': load,
+        'code': code,
+        'options': dict(options or {})
+    }
+
+
+def load_manifest(manifest_file):
+    """ Load the manifest of a previous run.
+
+    Args:
+        manifest_file: Path to the manifest JSON file.
+    """
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_file):
+    """ Save the manifest, replacing the previous one atomically.
+
+    Args:
+        manifest: Dictionary with the recorded state of each stage.
+        manifest_file: Path to the manifest JSON file.
+    """
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+
+def fingerprint_stages(stages):
+    """ Compute the fingerprint of every stage from its inputs, parameters, code and dependencies.
+
+    Args:
+        stages: Dictionary of stages, in dependency order.
+    """
+    fingerprints = {}
+    for name, stage in stages.items():
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            'func': stage['func'].__name__,
+            'args': [repr(arg) for arg in stage['args']],
+            'code': stage['code'],
+            'inputs': {path: file_hash(path) for path in stage['inputs']},
+            'deps': {dep: fingerprints[dep] for dep in stage['deps']}
+        }, sort_keys=True).encode('utf-8'))
+        fingerprints[name] = digest.hexdigest()
+    return fingerprints
+
+
+def saved_result(stage):
+    """ Return the path of the result saved by a previous run of the stage, or None.
+
+    Args:
+        stage: Stage created by make_stage.
+    """
+    return stage['cache']() if stage['cache'] is not None else None
+
+
+def plan_stages(stages, manifest, force=None):
+    """ Decide which stages must run.
+
+    A stage runs when it is forced, when its fingerprint differs from the
+    manifest, when one of its output files is missing, when one of the stages
+    it depends on runs, or when a stage that runs needs its result and no
+    saved result is available.
+
+    Args:
+        stages: Dictionary of stages, in dependency order.
+        manifest: Dictionary loaded by load_manifest.
+        force: List of stage names to run regardless of the manifest, 'all' to run every stage.
+
+    Returns:
+        A tuple with the fingerprints and a dictionary mapping each stage that must run to the reason.
+    """
+    force = set(force or [])
+    unknown = force - set(stages) - {'all'}
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}. Available stages: {', '.join(stages)}")
+
+    fingerprints = fingerprint_stages(stages)
+
+    plan = {}
+    for name, stage in stages.items():
+        if name in force or 'all' in force:
+            plan[name] = 'forced'
+        elif name not in manifest:
+            plan[name] = 'never built'
+        elif manifest[name]['fingerprint'] != fingerprints[name]:
+            plan[name] = 'fingerprint changed'
+        elif any(not os.path.exists(path) for path in stage['outputs']):
+            plan[name] = 'output missing'
+
+    # Rebuild the stages that use the result of a stage that runs
+    for name, stage in stages.items():
+        if name in plan:
+            continue
+        dep = next((dep for dep in stage['deps'] if dep in plan), None)
+        if dep is not None:
+            plan[name] = f"depends on {dep}"
+
+    # Rebuild the dependencies whose results are needed but were not saved
+    for name in reversed(list(stages)):
+        if name not in plan:
+            continue
+        for dep in stages[name]['deps']:
+            if dep not in plan and saved_result(stages[dep]) is None:
+                plan[dep] = f"needed by {name}"
+
+    return fingerprints, {name: plan[name] for name in stages if name in plan}
+
+
+def print_plan(stages, plan):
+    """ Print which stages are rebuilt and which are up to date.
+
+    Args:
+        stages: Dictionary of stages, in dependency order.
+        plan: Dictionary returned by plan_stages.
+    """
+    for name in stages:
+        status = f"rebuild ({plan[name]})" if name in plan else "up to date"
+        print(f"{name:<16} {status}")
+
+
+def run_stage(name, func, args, options=None):
+    """ Run one stage and measure its wall time, rows and peak memory.
+
+    The rows written default to the length of the result; the stage can
+    report other counts with instrumentation.count_rows.
+
+    Args:
+        name: Name of the stage.
+        func: Function that runs the stage.
+        args: Positional arguments passed to func.
+        options: Keyword arguments passed to func.
+
+    Returns:
+        A tuple with the result of func and the record returned by instrumentation.measure.
+    """
+    with measure(None, 'stage', name) as record:
+        result = func(*args, **(options or {}))
+        if record['rows_out'] is None and result is not None:
+            record['rows_out'] = len(result)
+    return result, record
+
+
+def run_stages(stages, plan, fingerprints, manifest, manifest_file, jobs=1, metrics=None):
+    """ Run the planned stages and record them in the manifest.
+
+    With jobs > 1 the stages run in a process pool, and each stage starts as
+    soon as the stages it depends on have finished. After a failure no new
+    stage is started; the running ones are allowed to finish.
+
+    Args:
+        stages: Dictionary of stages, in dependency order.
+        plan: Dictionary returned by plan_stages.
+        fingerprints: Fingerprints returned by plan_stages.
+        manifest: Dictionary loaded by load_manifest, updated in place.
+        manifest_file: Path to the manifest JSON file.
+        jobs: Number of worker processes.
+        metrics: Dictionary returned by instrumentation.open_metrics, or None to not record the stages.
+    """
+    results = {}
+    pending = [name for name in stages if name in plan]
+    running = {}
+    failed = []
+    start = time.perf_counter()
+
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        while pending or running:
+            for name in list(pending):
+                stage = stages[name]
+                if failed:
+                    pending.remove(name)
+                    print(f"{name:<16} skipped after failure")
+                    continue
+                if any(dep in pending or dep in running.values() for dep in stage['deps']):
+                    continue
+
+                pending.remove(name)
+                dep_results = [results[dep] if dep in results else stage_load(stages[dep]) for dep in stage['deps']]
+                args = (dep_results, *stage['args']) if stage['deps'] else stage['args']
+
+                if executor is not None:
+                    running[executor.submit(run_stage, name, stage['func'], args, stage['options'])] = name
+                    continue
+
+                # Run in this process, wrapped in a future like the pool results
+                future = Future()
+                try:
+                    future.set_result(run_stage(name, stage['func'], args, stage['options']))
+                except Exception as e:
+                    future.set_exception(e)
+                running[future] = name
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    failed.append(name)
+                    write_record(metrics, {'kind': 'stage', 'name': name, 'status': 'failed', 'error': repr(error)})
+                    print(f"{name:<16} failed: {error!r}")
+                    traceback.print_exception(error)
+                    continue
+
+                results[name], record = future.result()
+                write_record(metrics, record)
+                print(f"{name:<16} finished in {record['wall_s']:.1f}s")
+
+                manifest[name] = {
+                    'fingerprint': fingerprints[name],
+                    'inputs': stages[name]['inputs'],
+                    'outputs': stages[name]['outputs'],
+                    'built_at': datetime.now().isoformat(timespec='seconds')
+                }
+                save_manifest(manifest, manifest_file)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"Pipeline finished in {time.perf_counter() - start:.1f}s")
+    if failed:
+        raise RuntimeError(f"Stages failed: {', '.join(failed)}")
+
+    return results
+
+
+def stage_load(stage):
+    """ Load the result saved by a previous run of the stage.
+
+    Args:
+        stage: Stage created by make_stage.
+    """
+    return stage['load'](saved_result(stage))
@@ -1,9 +1,16 @@
 import pandas as pd
+import numpy as np
 import argparse
+import csv
+import hashlib
 import os
 import re
 import unicodedata
+from functools import lru_cache, partial
+from itertools import islice
 from rapidfuzz import fuzz, process
+from instrumentation import count_rows, open_metrics
+from pipeline import MANIFEST_NAME, file_hash, load_manifest, make_stage, plan_stages, print_plan, run_stages
 
 lookup_df = pd.DataFrame({
     'CO_UF': [
@@ -25,6 +32,114 @@ lookup_df = pd.DataFrame({
     ]
 })
 
+# Columns read from the Censo da Educação Superior trajectory file, in file order.
+# Codes and counts are read as nullable integers, exact at any size, because
+# they may be missing until dropna; the dropout rate is parsed later.
+INDICADORES_DTYPES = {
+    'CO_IES': 'Int32',
+    'NO_IES': 'category',
+    'TP_CATEGORIA_ADMINISTRATIVA': 'UInt8',
+    'TP_ORGANIZACAO_ACADEMICA': 'UInt8',
+    'CO_CURSO': 'Int32',
+    'NO_CURSO': 'category',
+    'CO_UF': 'Int32',
+    'CO_MUNICIPIO': 'Int32',
+    'TP_GRAU_ACADEMICO': 'UInt8',
+    'TP_MODALIDADE_ENSINO': 'UInt8',
+    'CO_CINE_AREA_GERAL': 'Int32',
+    'NO_CINE_AREA_GERAL': 'category',
+    'NU_ANO_REFERENCIA': 'Int16',
+    'QT_INGRESSANTE': 'Int32',
+    'QT_CONCLUINTE': 'Int32',
+    'TDA': str
+}
+
+# Column order and compact types of every table produced by the pipeline
+SCHEMAS = {
+    'indicadores_educacao': {
+        'inst_cod': 'int32',
+        'inst_nome': 'category',
+        'inst_busca': 'category',
+        'categoria_adm': 'uint8',
+        'org_academica': 'uint8',
+        'curso_cod': 'int32',
+        'curso_nome': 'category',
+        'curso_busca': 'category',
+        'municipio_cod': 'int32',
+        'grau_academico': 'uint8',
+        'modo_ensino': 'uint8',
+        'area_cod': 'uint8',
+        'nome_area_atuacao': 'category',
+        'ano_referencia': 'int16',
+        'num_ingressantes': 'int32',
+        'num_concluintes': 'int32',
+        'taxa_desistencia': 'float32',
+        'uf_sigla': 'category',
+        'uf_nome': 'category'
+    },
+    'rais_tabela4': {
+        'uf_sigla': 'category',
+        'municipio_cod': 'int32',
+        'municipio_nome': 'category',
+        'setor_nome': 'category',
+        'ano': 'int16',
+        'num_pessoas_empregadas': 'Int32',
+        'ano_base': 'int16'
+    },
+    'rais_tabela4_joined': {
+        'uf_sigla': 'category',
+        'municipio_cod': 'int32',
+        'municipio_nome': 'category',
+        'municipio_busca': 'category',
+        'setor_nome': 'category',
+        'setor_busca': 'category',
+        'ano': 'int16',
+        'num_pessoas_empregadas': 'int32'
+    },
+    'rais_tabela6': {
+        'uf_nome': 'category',
+        'ano': 'int16',
+        'media_remuneracao': 'float64',
+        'ano_base': 'int16'
+    },
+    'rais_tabela6_joined': {
+        'uf_nome': 'category',
+        'ano': 'int16',
+        'media_remuneracao': 'float64',
+        'uf_sigla': 'category'
+    }
+}
+
+INTERMEDIATE_FORMATS = ('parquet', 'feather')
+
+YEAR = re.compile(r"(?:19|20)\d{2}")
+
+RELEASE_YEAR = re.compile(r"Ano:\s*((?:19|20)\d{2})")
+
+UF_SIGLA = re.compile(r"[A-Z]{2}")
+
+# Any change to this module invalidates every stage
+CODE_VERSION = file_hash(__file__)
+
+CROSSWALK_COLUMNS = ['uf_sigla', 'name_norm', 'municipio_cod', 'municipio_nome', 'match_score', 'reference_hash']
+
+MIN_MATCH_SCORE = 90
+
+NORMALIZE_CACHE_SIZE = 65536
+
+def apply_schema(df, name):
+    """ Cast the columns of a DataFrame to the types of its schema, in schema order.
+
+    Columns of the schema missing from the DataFrame are skipped.
+
+    Args:
+        df: The DataFrame to cast.
+        name: Name of the schema in SCHEMAS.
+    """
+    schema = {column: dtype for column, dtype in SCHEMAS[name].items() if column in df.columns}
+    return df[list(schema)].astype(schema)
+
+
 def normalize_string(s):
     """ Normalize a string by removing special characters and converting to lowercase.
     Args:
@@ -39,6 +154,22 @@ def normalize_string(s):
     return s.strip()
 
 
+_normalize_cached = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(normalize_string)
+
+
+def normalize_series(series):
+    """ Normalize every value of a Series, computing each distinct value only once.
+
+    Args:
+        series: The Series of strings to normalize.
+    """
+    codes, uniques = pd.factorize(series)
+    normalized = np.array([_normalize_cached(value) for value in uniques] + [''], dtype=object)
+
+    # Missing values get code -1, which points at the trailing empty string
+    return pd.Series(normalized[codes], index=series.index, name=series.name)
+
+
 def match_name(name, choices, scorer=fuzz.token_sort_ratio):
     """ Match a name to a list of choices using fuzzy matching.
     Args:
@@ -52,52 +183,286 @@ def match_name(name, choices, scorer=fuzz.token_sort_ratio):
     else:
         return (None, 0, None)
 
-def fix_value(val):
-    """ Fix the value by removing dots and converting to integer.
-    
+def match_municipios(df_source, df_reference, scorer=fuzz.token_sort_ratio):
+    """ Match the municipalities of a RAIS table against a reference table.
+
+    Only the distinct (uf_sigla, name_norm) keys are matched. Exact matches are
+    resolved with a hash join and the remaining names go through one batched
+    score matrix per UF.
+
     Args:
-        val: The value to fix.
+        df_source: DataFrame with the 'uf_sigla' and 'name_norm' columns to match.
+        df_reference: DataFrame with the 'uf_sigla', 'name_norm', 'municipio_cod' and 'municipio_nome' columns.
+        scorer: The scoring function to use for matching.
     """
-    try:
-        val_str = str(val)
-        parts = val_str.split('.')
-        if len(parts) == 2:
-            integer_part, decimal_part = parts
-            if len(decimal_part) > 1:
-                return int(integer_part + decimal_part)
-            else:
-                return int(float(val))
+    keys = df_source[['uf_sigla', 'name_norm']].drop_duplicates()
+    reference = df_reference[['uf_sigla', 'name_norm', 'municipio_cod', 'municipio_nome']].drop_duplicates(subset=['uf_sigla', 'name_norm'])
+
+    # Exact matches
+    exact = keys.merge(reference, on=['uf_sigla', 'name_norm'], how='inner')
+    exact['match_score'] = 100.0
+
+    # Fuzzy matches for the leftovers, one score matrix per UF
+    leftovers = keys.merge(exact[['uf_sigla', 'name_norm']], on=['uf_sigla', 'name_norm'], how='left', indicator=True)
+    leftovers = leftovers[leftovers['_merge'] == 'left_only'].drop(columns='_merge')
+
+    candidates = {uf: group for uf, group in reference.groupby('uf_sigla', sort=False, observed=True)}
+
+    fuzzy = []
+    for uf, group in leftovers.groupby('uf_sigla', sort=False, observed=True):
+        if uf not in candidates:
+            continue
+        choices = candidates[uf]
+        scores = process.cdist(group['name_norm'].tolist(), choices['name_norm'].tolist(), scorer=scorer, workers=-1)
+        best = scores.argmax(axis=1)
+        fuzzy.append(pd.DataFrame({
+            'uf_sigla': uf,
+            'name_norm': group['name_norm'].to_numpy(),
+            'municipio_cod': choices['municipio_cod'].to_numpy()[best],
+            'municipio_nome': choices['municipio_nome'].to_numpy()[best],
+            'match_score': scores[np.arange(len(best)), best].astype(float)
+        }))
+
+    return pd.concat([exact, *fuzzy], ignore_index=True)
+
+
+def hash_reference(df_reference):
+    """ Compute a content hash of the reference municipality index.
+
+    Args:
+        df_reference: DataFrame with the 'uf_sigla', 'name_norm', 'municipio_cod' and 'municipio_nome' columns.
+    """
+    reference = df_reference[['uf_sigla', 'name_norm', 'municipio_cod', 'municipio_nome']].drop_duplicates(subset=['uf_sigla', 'name_norm'])
+    reference = reference.sort_values(['uf_sigla', 'name_norm'])
+    return hashlib.sha256(reference.to_csv(index=False, sep=';').encode('utf-8')).hexdigest()
+
+
+def load_crosswalk(crosswalk_csv, reference_hash):
+    """ Load the municipality crosswalk cache, keeping only the entries built against the current reference.
+
+    Args:
+        crosswalk_csv: Path to the crosswalk cache CSV file.
+        reference_hash: Content hash of the reference municipality index.
+    """
+    if crosswalk_csv is None or not os.path.exists(crosswalk_csv):
+        return pd.DataFrame(columns=CROSSWALK_COLUMNS)
+
+    crosswalk = pd.read_csv(crosswalk_csv, sep=';', dtype={'name_norm': str, 'reference_hash': str}, keep_default_na=False)
+    crosswalk = crosswalk[crosswalk['reference_hash'] == reference_hash]
+    crosswalk['municipio_cod'] = crosswalk['municipio_cod'].astype(int)
+    crosswalk['match_score'] = crosswalk['match_score'].astype(float)
+
+    return crosswalk[CROSSWALK_COLUMNS]
+
+
+def save_crosswalk(crosswalk, crosswalk_csv, min_score=MIN_MATCH_SCORE):
+    """ Save the municipality crosswalk cache and a report of the low score matches next to it.
+
+    Args:
+        crosswalk: DataFrame with the crosswalk entries.
+        crosswalk_csv: Path to the crosswalk cache CSV file.
+        min_score: Matches below this score are listed in the report.
+    """
+    crosswalk = crosswalk.sort_values(['uf_sigla', 'name_norm'])
+    crosswalk = crosswalk.astype({'municipio_cod': int})
+    crosswalk['match_score'] = crosswalk['match_score'].round(2)
+    crosswalk.to_csv(crosswalk_csv, index=False, sep=';')
+
+    low_score = crosswalk[crosswalk['match_score'] < min_score].sort_values('match_score')
+    report_file = os.path.splitext(crosswalk_csv)[0] + '_low_score.csv'
+    low_score.to_csv(report_file, index=False, sep=';')
+
+    if not low_score.empty:
+        print(f"{len(low_score)} municipality matches scored below {min_score}, see {report_file}")
+
+
+def parse_number(series, thousands='.,', decimal=None):
+    """ Parse a column of numbers exported with Brazilian (or mixed) separators.
+
+    Integers accept any of the thousands separators and a stray '.0' suffix
+    (e.g. '1.436', '1,436', '1.436.0', '437.0'). Decimals use the given
+    decimal separator (e.g. '3.893,99' with thousands='.' and decimal=',').
+
+    Args:
+        series: The Series to parse.
+        thousands: Characters accepted as thousands separators, or None.
+        decimal: The decimal separator, or None to parse integers.
+
+    Returns:
+        A tuple with the parsed nullable Int64 (or Float64) Series and a DataFrame
+        with the position and value of every rejected entry.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        # Already parsed by read_csv, only integers need checking
+        values = series.astype('Float64')
+        valid = (values % 1 == 0).fillna(False).to_numpy(dtype=bool) if decimal is None else values.notna().to_numpy(dtype=bool)
+        values = values.where(valid).astype('Int64' if decimal is None else 'Float64')
+    else:
+        text = series.astype('string').str.strip()
+
+        grouped = rf"\d{{1,3}}(?:[{re.escape(thousands)}]\d{{3}})+|" if thousands else ""
+        if decimal is None:
+            text = text.str.replace(r"\.0$", "", regex=True)
+            pattern = rf"[+-]?(?:{grouped}\d+)"
         else:
-            # Handle unexpected formats like '1.436.0' by removing all dots
-            return int(val_str.replace('.', ''))
-    except Exception as e:
-        print(f"Error with value {val}: {e}")
-        return None  # or raise, or some default
+            pattern = rf"[+-]?(?:{grouped}\d+)(?:{re.escape(decimal)}\d+)?"
+
+        valid = text.str.fullmatch(pattern).fillna(False).to_numpy(dtype=bool)
+
+        cleaned = text.where(valid)
+        if thousands:
+            cleaned = cleaned.str.replace(f"[{re.escape(thousands)}]", "", regex=True)
+        if decimal is not None:
+            cleaned = cleaned.str.replace(decimal, ".", regex=False)
 
+        values = pd.to_numeric(cleaned).astype('Int64' if decimal is None else 'Float64')
+
+    invalid = ~valid & series.notna().to_numpy()
+    rejected = pd.DataFrame({
+        'position': np.flatnonzero(invalid),
+        'value': series.to_numpy()[invalid]
+    })
+
+    return values, rejected
+
+
+def report_rejected(rejected, column):
+    """ Print a single summary of the values rejected by parse_number.
+
+    Args:
+        rejected: The DataFrame of rejected values returned by parse_number.
+        column: Name of the parsed column, used in the message.
+    """
+    if rejected.empty:
+        return
 
-def process_indicadores(indicadores_csv, output_csv):
+    summary = rejected.groupby('value', sort=False)['position'].agg(['count', 'first'])
+    print(f"{len(rejected)} values rejected in {column}:")
+    for value, row in summary.iterrows():
+        print(f"    {value!r}: {row['count']} rows (first at position {row['first']})")
+
+
+def write_intermediate(df, output_csv, name, intermediate):
+    """ Save an intermediate DataFrame in a typed columnar format, if requested.
+
+    When no format is requested, intermediate files left by previous runs are
+    removed so they are never mistaken for the current result.
+
+    Args:
+        df: The DataFrame to save.
+        output_csv: Path to the directory where the file will be saved.
+        name: Name of the file, without extension.
+        intermediate: 'parquet', 'feather' or None to skip writing.
+    """
+    if intermediate is None:
+        stale_file = find_intermediate(output_csv, name)
+        if stale_file is not None:
+            os.remove(stale_file)
+        return
+
+    output_file = os.path.join(output_csv, f"{name}.{intermediate}")
+    if intermediate == 'parquet':
+        df.to_parquet(output_file, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(output_file)
+
+
+def find_intermediate(output_csv, name):
+    """ Find an intermediate file saved by write_intermediate.
+
+    Args:
+        output_csv: Path to the directory where the file was saved.
+        name: Name of the file, without extension.
+
+    Returns:
+        The path of the file, or None if no intermediate file exists.
+    """
+    for intermediate in INTERMEDIATE_FORMATS:
+        input_file = os.path.join(output_csv, f"{name}.{intermediate}")
+        if os.path.exists(input_file):
+            return input_file
+
+    return None
+
+
+def read_intermediate(input_file):
+    """ Load an intermediate file saved by write_intermediate.
+
+    Args:
+        input_file: Path returned by find_intermediate.
+    """
+    if input_file.endswith('.parquet'):
+        return pd.read_parquet(input_file)
+    return pd.read_feather(input_file)
+
+
+def process_indicadores(indicadores_csv, output_csv, chunksize=None):
     """ Process the indicadores CSV file and save it to a new location.
 
+    Only the needed columns are read. When chunksize is given the file is
+    streamed in chunks of that many rows, each one processed and appended to
+    the output, so memory usage depends on the chunk size and not on the file size.
+
     Args:
         indicadores_csv: Path to the CSV file containing the indicadores data.
         output_csv: Path to the directory where the processed CSV file will be saved.
+        chunksize: Number of rows per chunk, or None to read the whole file at once.
+
+    Returns:
+        The processed DataFrame, or None when streaming in chunks.
     """
 
     # Read the CSV file
-    df = pd.read_csv(
+    reader = pd.read_csv(
         indicadores_csv, 
         delimiter=',', 
         encoding='utf-8',
         skiprows=8,
-        low_memory=False,
-        header=0
+        header=0,
+        usecols=list(INDICADORES_DTYPES),
+        dtype=INDICADORES_DTYPES,
+        chunksize=chunksize
     )
+    chunks = [reader] if chunksize is None else reader
+
+    output_file = os.path.join(output_csv, 'indicadores_educacao.csv')
+
+    if os.path.exists(output_file):
+        open(output_file, 'w').close()
+
+    rejected = []
+    offset = 0
+    for i, chunk in enumerate(chunks):
+        df, chunk_rejected = process_indicadores_chunk(chunk)
+
+        chunk_rejected['position'] += offset
+        rejected.append(chunk_rejected)
+        offset += len(chunk)
+        count_rows(rows_in=len(chunk), rows_out=len(df))
+
+        # Save the processed chunk, appending after the first one
+        df.to_csv(output_file, index=False, sep=';', mode='w' if i == 0 else 'a', header=(i == 0))
+
+    if rejected:
+        report_rejected(pd.concat(rejected, ignore_index=True), 'taxa_desistencia')
+
+    # The streamed data is never held in memory as a whole
+    return df if chunksize is None else None
+
+
+def process_indicadores_chunk(df):
+    """ Clean one chunk of the indicadores data.
+
+    Args:
+        df: DataFrame with the raw indicadores columns.
+
+    Returns:
+        A tuple with the processed DataFrame and the rejected taxa_desistencia values.
+    """
 
     # Match the UF codes with the lookup table
     df = df.merge(lookup_df, on='CO_UF', how='left')
-    
-    # Delete unnecessary columns
-    df.drop(columns=['CO_REGIAO', 'CO_UF', 'CO_CINE_ROTULO', 'NO_CINE_ROTULO', 'NU_ANO_INGRESSO', 'NU_PRAZO_INTEGRALIZACAO', 'NU_ANO_INTEGRALIZACAO', 'NU_PRAZO_ACOMPANHAMENTO', 'NU_ANO_MAXIMO_ACOMPANHAMENTO', 'QT_PERMANENCIA', 'QT_DESISTENCIA', 'QT_FALECIDO', 'TAP', 'TCA', 'TCAN', 'TADA'], inplace=True)
+    df.drop(columns=['CO_UF'], inplace=True)
 
     # Rename columns
     df.rename(columns={
@@ -118,349 +483,284 @@ def process_indicadores(indicadores_csv, output_csv):
         'TDA': 'taxa_desistencia'
     }, inplace=True)
 
-    # Save the processed DataFrame to a new CSV file
-
     df = df.dropna()
 
-    df['inst_cod'] = df['inst_cod'].astype(int)
-    df['categoria_adm'] = df['categoria_adm'].astype(int)
-    df['org_academica'] = df['org_academica'].astype(int)
-    df['curso_cod'] = df['curso_cod'].astype(int)
-    df['municipio_cod'] = df['municipio_cod'].astype(int)
-    df['grau_academico'] = df['grau_academico'].astype(int)
-    df['modo_ensino'] = df['modo_ensino'].astype(int)
-    df['area_cod'] = df['area_cod'].astype(int)
-    df['ano_referencia'] = df['ano_referencia'].astype(int)
-    df['num_ingressantes'] = df['num_ingressantes'].astype(int)
-    df['num_concluintes'] = df['num_concluintes'].astype(int)
-    df['taxa_desistencia'] = df['taxa_desistencia'].str.replace(',', '.', regex=False)
+    df['taxa_desistencia'], rejected = parse_number(df['taxa_desistencia'], thousands=None, decimal=',')
 
-    output_file = os.path.join(output_csv, 'indicadores_educacao.csv')
+    # Accent-folded search keys of the names, stored on the graph nodes
+    df['curso_busca'] = normalize_series(df['curso_nome'])
+    df['inst_busca'] = normalize_series(df['inst_nome'])
 
-    if os.path.exists(output_file):
-        open(output_file, 'w').close()
+    return apply_schema(df, 'indicadores_educacao'), rejected
 
-    df.to_csv(output_file, index=False, sep=';')
 
-    return 
+def read_raw_rows(rais_csv):
+    """ Read every row of a RAIS export as a list of stripped strings.
 
+    The exports have preambles, footers and rows with a varying number of
+    fields, so they are read with the csv module instead of pd.read_csv.
 
-def process_rais_4_2021(tabela4_csv, output_csv):
-    """ Process the RAIS Tabela 4 2021 CSV file and save it to a new location.
     Args:
-        tabela4_csv: Path to the CSV file containing the RAIS Tabela 4 data.
-        output_csv: Path to the directory where the processed CSV file will be saved.
+        rais_csv: Path to the RAIS CSV file.
     """
+    with open(rais_csv, encoding='utf-8', newline='') as f:
+        return [[cell.strip() for cell in row] for row in csv.reader(f)]
 
-    df = pd.read_csv(
-        tabela4_csv, 
-        delimiter=',', 
-        encoding='utf-8',
-        low_memory=False,
-        skiprows=12,
-        header=[0,1]
-    )
-
-    # Delete unnecessary columns
-    df.drop(columns=['Unnamed: 0_level_0', 'Unnamed: 5_level_0', 'Unnamed: 6_level_0', 'Unnamed: 9_level_0', 'Unnamed: 10_level_0', 'Unnamed: 13_level_0', 'Unnamed: 14_level_0', 'Unnamed: 17_level_0', 'Unnamed: 18_level_0', 'Unnamed: 21_level_0', 'Unnamed: 22_level_0', 'Unnamed: 24_level_0', 'Unnamed: 25_level_0', 'Unnamed: 26_level_0', 'Total'], inplace=True)
-    
-
-    df.rename(columns={
-        'Unnamed: 4_level_0': 'Agropecuária',
-        'Unnamed: 8_level_0': 'Indústria',
-        'Unnamed: 12_level_0': 'Construção',
-        'Unnamed: 16_level_0': 'Comércio',
-        '5 - Comércio': 'Serviços'
-    }, inplace=True)
-
-    # Select relevant columns
-    df.columns.names = ['Type', 'Year'] 
-    df.columns = [f"{type}_{year}" if type is not None else year for type, year in df.columns]
-
-    df.rename(columns={
-        'UF_Unnamed: 1_level_1': 'UF',
-        'Município_Unnamed: 2_level_1': 'Município'
-    }, inplace=True)
-
-    df_melted = df.melt(
-        id_vars=['UF', 'Município'],     
-        var_name='Área_Ano',                
-        value_name='Empregados'                   
-    )
-
-    df_melted[['Área', 'Ano']] = df_melted['Área_Ano'].str.split('_', expand=True)
-
-    # Drop the original combined column
-    df_melted = df_melted.drop(columns='Área_Ano')
-
-    # Reorder columns
-    df_melted = df_melted[['UF', 'Município', 'Área', 'Ano', 'Empregados']]
-
-    df_melted.rename(columns={
-        'UF': 'uf_sigla',
-        'Município': 'municipio_nome',
-        'Área': 'setor_nome',
-        'Ano': 'ano',
-        'Empregados': 'num_pessoas_empregadas'
-    }, inplace=True)
-
-    df_melted['num_pessoas_empregadas'] = df_melted['num_pessoas_empregadas'].str.replace(',', '', regex=False)
-
-    df_melted = df_melted.dropna()
-
-    output_file = os.path.join(output_csv, 'rais_tabela4_2021.csv')
-    if os.path.exists(output_file):
-        open(output_file, 'w').close()
-
-    df_melted.to_csv(output_file, index=False, sep=';')
 
-    return 
+def read_release_year(rais_csv, max_rows=40):
+    """ Read the base year of a RAIS export from its 'Ano: YYYY' preamble line.
 
-
-def process_rais_6_2021(tabela6_csv, output_csv):
-    """ Process the RAIS Tabela 6 2021 CSV file and save it to a new location.
     Args:
-        tabela6_csv: Path to the CSV file containing the RAIS Tabela 6 data.
-        output_csv: Path to the directory where the processed CSV file will be saved.
+        rais_csv: Path to the RAIS CSV file.
+        max_rows: Number of rows searched for the preamble.
     """
-    df = pd.read_csv(
-        tabela6_csv, 
-        delimiter=',', 
-        encoding='utf-8',
-        low_memory=False,
-        skiprows=11,
-        header=0
-    )
+    with open(rais_csv, encoding='utf-8', newline='') as f:
+        for row in islice(csv.reader(f), max_rows):
+            for cell in row:
+                match = RELEASE_YEAR.fullmatch(cell.strip())
+                if match:
+                    return int(match.group(1))
 
-    df.drop(columns=['Unnamed: 0', 'Indicadores', 'Variação', 'Unnamed: 6'], inplace=True)
+    raise ValueError(f"Could not find the 'Ano: YYYY' line in {rais_csv}")
 
-    df.rename(columns={
-        'Unnamed: 2': 'Tipo',
-        'Ano': '2020',
-        'Unnamed: 4': '2021',
 
-    }, inplace=True)
+def sniff_rais_4_layout(rows):
+    """ Find the header rows and the sector column groups of a RAIS Tabela 4 export.
 
-    macro_regions = {"Norte", "Nordeste", "Centro-Oeste", "Sudeste", "Sul"}
-    
-    is_region = df['Tipo'].isin(macro_regions)
+    The header row is the one with the 'UF' and 'Município' labels and the row
+    below it holds the years. Each sector is a run of consecutive year columns,
+    named by the label above its first column.
 
-    is_region.index = df.index
+    Args:
+        rows: Rows returned by read_raw_rows.
 
-    df_uf = df[~is_region]
+    Returns:
+        A tuple with the index of the first data row, a dictionary mapping the
+        identifier columns to their positions and a list of (setor, ano, column) tuples.
+    """
+    header_idx = next((i for i, row in enumerate(rows) if 'UF' in row and 'Município' in row), None)
+    if header_idx is None:
+        raise ValueError("Could not find the 'UF' and 'Município' header row")
 
-    stop_uf = df_uf[df_uf['Tipo'] == 'Agricultura, pecuária, produção florestal, pesca e aquicultura'].index
+    header = rows[header_idx]
+    years = rows[header_idx + 1]
 
-    if not stop_uf.empty:
-        df_uf = df_uf.loc[:stop_uf[0]-1]
+    ids = {'uf_sigla': header.index('UF'), 'municipio_nome': header.index('Município')}
+    if 'Código' in header:
+        ids['municipio_cod'] = header.index('Código')
 
-    df_uf = df_uf.dropna()
+    groups = []
+    setor = None
+    for col in range(max(ids.values()) + 1, len(years)):
+        if not YEAR.fullmatch(years[col]):
+            continue
+        if not YEAR.fullmatch(years[col - 1]):
+            # Start of a new run, named by the closest label at or before it
+            labels = [label for label in header[:col + 1] if label]
+            setor = labels[-1] if labels else None
+        if setor is not None and setor != 'Total':
+            groups.append((setor, int(years[col]), col))
 
-    df_uf = df_uf.melt(
-        id_vars=['Tipo'],
-        var_name='Ano',
-        value_name='Renumeração'
-    )
-
-    df_uf.rename(columns={
-        'Tipo': 'uf_nome',
-        'Ano': 'ano',
-        'Renumeração': 'media_remuneracao'
-    }, inplace=True)
+    return header_idx + 2, ids, groups
 
-    df_uf['media_remuneracao'] = df_uf['media_remuneracao'].str.replace(',', '', regex=False)
 
-    output_file_uf = os.path.join(output_csv, 'rais_tabela6_2021.csv')
-    if os.path.exists(output_file_uf):
-        open(output_file_uf, 'w').close()
+def sniff_separators(values):
+    """ Guess the thousands and decimal separators of a column of decimal numbers.
 
-    df_uf.to_csv(output_file_uf, index=False, sep=';')
+    Args:
+        values: Series of numbers as strings.
 
-    return
+    Returns:
+        A tuple (thousands, decimal).
+    """
+    comma = values.str.contains(r",\d{1,2}$", regex=True).sum()
+    dot = values.str.contains(r"\.\d{1,2}$", regex=True).sum()
+    return ('.', ',') if comma > dot else (',', '.')
 
 
-def process_rais_4_2023(tabela4_csv, output_csv):
-    """ Process the RAIS Tabela 4 2023 CSV file and save it to a new location.
+def process_rais_4(tabela4_csv, output_csv, intermediate=None):
+    """ Process a RAIS Tabela 4 CSV file of any year and return it.
 
     Args:
         tabela4_csv: Path to the CSV file containing the RAIS Tabela 4 data.
-        output_csv: Path to the directory where the processed CSV file will be saved.
+        output_csv: Path to the directory where the intermediate file is saved.
+        intermediate: Format of the intermediate file ('parquet' or 'feather'), or None to keep it in memory only.
     """
-    df = pd.read_csv(
-        tabela4_csv, 
-        delimiter=',', 
-        encoding='utf-8',
-        low_memory=False,
-        skiprows=12,
-        header=[0,1]
-    )
-
-    # Delete unnecessary columns
-    df.drop(columns=['Unnamed: 0_level_0', 'Unnamed: 6_level_0', 'Unnamed: 7_level_0', 'Unnamed: 10_level_0', 'Unnamed: 11_level_0', 'Unnamed: 14_level_0', 'Unnamed: 15_level_0', 'Unnamed: 18_level_0', 'Unnamed: 19_level_0', 'Unnamed: 22_level_0', 'Unnamed: 23_level_0', 'Unnamed: 25_level_0', 'Unnamed: 26_level_0', 'Unnamed: 27_level_0', 'Total'], inplace=True)
-
-    # Rename columns
-    df.rename(columns={
-        'Unnamed: 5_level_0': 'Agropecuária',
-        'Unnamed: 9_level_0': 'Indústria',
-        'Unnamed: 13_level_0': 'Construção',
-        'Unnamed: 17_level_0': 'Comércio',
-        'Unnamed: 21_level_0': 'Serviços'
-    }, inplace=True)
-
-    # Select relevant columns
-    df.columns.names = ['Type', 'Year'] 
-    df.columns = [f"{type}_{year}" if type is not None else year for type, year in df.columns]
-
-    df.rename(columns={
-        'UF_Unnamed: 1_level_1': 'UF',
-        'Código_Unnamed: 2_level_1': 'Código',
-        'Município_Unnamed: 3_level_1': 'Município'
-    }, inplace=True)
-
-    df_melted = df.melt(
-        id_vars=['UF','Código', 'Município'],     
-        var_name='Área_Ano',                
-        value_name='Empregados'                   
-    )
-
-    df_melted[['Área', 'Ano']] = df_melted['Área_Ano'].str.split('_', expand=True)
-
-    # Drop the original combined column
-    df_melted = df_melted.drop(columns='Área_Ano')
+    rows = read_raw_rows(tabela4_csv)
+    release = read_release_year(tabela4_csv)
+    start, ids, groups = sniff_rais_4_layout(rows)
+
+    width = max([*ids.values(), *(col for _, _, col in groups)]) + 1
+    data = [
+        row for row in rows[start:]
+        if len(row) >= width and UF_SIGLA.fullmatch(row[ids['uf_sigla']]) and row[ids['municipio_nome']]
+    ]
+    df = pd.DataFrame(data).iloc[:, :width]
+    count_rows(rows_in=len(df))
+
+    # Melt into one block of rows per (sector, year) column, in file order.
+    # The repeated text columns are built from categorical codes.
+    n_rows = len(df)
+    n_groups = len(groups)
+
+    melted = {}
+    for name, col in sorted(ids.items(), key=lambda item: item[1]):
+        if name == 'municipio_cod':
+            melted[name] = np.tile(df[col].astype('int32').to_numpy(), n_groups)
+        else:
+            values = pd.Categorical(df[col])
+            melted[name] = pd.Categorical.from_codes(np.tile(values.codes, n_groups), values.categories)
 
-    # Reorder columns
-    df_melted = df_melted[['UF', 'Código', 'Município', 'Área', 'Ano', 'Empregados']]
+    setores = list(dict.fromkeys(setor for setor, _, _ in groups))
+    melted['setor_nome'] = pd.Categorical.from_codes(np.repeat([setores.index(setor) for setor, _, _ in groups], n_rows), setores)
+    melted['ano'] = np.repeat(np.array([ano for _, ano, _ in groups], dtype='int16'), n_rows)
+    melted['num_pessoas_empregadas'] = np.concatenate([df[col].to_numpy() for _, _, col in groups])
 
-    df_melted.rename(columns={
-        'UF': 'uf_sigla',
-        'Código': 'municipio_cod',
-        'Município': 'municipio_nome',
-        'Área': 'setor_nome',
-        'Ano': 'ano',
-        'Empregados': 'num_pessoas_empregadas'
-    }, inplace=True)
+    df_melted = pd.DataFrame(melted)
+    df_melted['num_pessoas_empregadas'] = df_melted['num_pessoas_empregadas'].mask(df_melted['num_pessoas_empregadas'] == '')
 
     df_melted = df_melted.dropna()
 
-    df_melted['num_pessoas_empregadas'] = df_melted['num_pessoas_empregadas'].apply(fix_value)
+    df_melted['num_pessoas_empregadas'], rejected = parse_number(df_melted['num_pessoas_empregadas'])
+    report_rejected(rejected, 'num_pessoas_empregadas')
 
+    df_melted['ano_base'] = release
+    df_melted = apply_schema(df_melted, 'rais_tabela4')
 
-    # Save the processed DataFrame to a new CSV file
-    output_file = os.path.join(output_csv, 'rais_tabela4_2023.csv')
-    if os.path.exists(output_file):
-        open(output_file, 'w').close()
+    write_intermediate(df_melted, output_csv, f"rais_tabela4_{release}", intermediate)
 
-    df_melted.to_csv(output_file, index=False, sep=';')
+    return df_melted
 
-    return
 
+def process_rais_6(tabela6_csv, output_csv, intermediate=None):
+    """ Process a RAIS Tabela 6 CSV file of any year and return it.
 
-def process_rais_6_2023(tabela6_csv, output_csv):
-    """ Process the RAIS Tabela 6 2023 CSV file and save it to a new location.
+    Only the state (UF) rows of the first table are kept. The year columns
+    are taken from the first row with years in it, and the separators of the
+    remuneration values are guessed from the values themselves.
 
     Args:
         tabela6_csv: Path to the CSV file containing the RAIS Tabela 6 data.
-        output_csv: Path to the directory where the processed CSV file will be saved.
+        output_csv: Path to the directory where the intermediate file is saved.
+        intermediate: Format of the intermediate file ('parquet' or 'feather'), or None to keep it in memory only.
     """
-    df = pd.read_csv(
-        tabela6_csv, 
-        delimiter=',', 
-        encoding='utf-8',
-        low_memory=False,
-        skiprows=11,
-        header=0,
-    )
+    rows = read_raw_rows(tabela6_csv)
+    release = read_release_year(tabela6_csv)
+
+    year_idx = next((i for i, row in enumerate(rows) if sum(bool(YEAR.fullmatch(cell)) for cell in row) >= 2), None)
+    if year_idx is None:
+        raise ValueError(f"Could not find the year header row in {tabela6_csv}")
+    year_columns = [(col, int(cell)) for col, cell in enumerate(rows[year_idx]) if YEAR.fullmatch(cell)]
+
+    uf_names = set(lookup_df['uf_nome'])
+    uf_rows = {}
+    for row in rows[year_idx + 1:]:
+        for cell in row:
+            if cell in uf_names:
+                # The state block comes first, later tables may repeat the names
+                uf_rows.setdefault(cell, row)
+                break
+    count_rows(rows_in=len(uf_rows))
+
+    df_uf = pd.concat([
+        pd.DataFrame({
+            'uf_nome': list(uf_rows),
+            'ano': ano,
+            'media_remuneracao': [row[col] if col < len(row) else '' for row in uf_rows.values()]
+        })
+        for col, ano in year_columns
+    ], ignore_index=True)
+
+    values = df_uf['media_remuneracao'].mask(df_uf['media_remuneracao'] == '')
+    thousands, decimal = sniff_separators(values.dropna())
+    df_uf['media_remuneracao'], rejected = parse_number(values, thousands=thousands, decimal=decimal)
+    report_rejected(rejected, 'media_remuneracao')
 
-    df.drop(columns=['Unnamed: 0', 'Indicadores', 'Variação Absoluta', 'Variação Relativa'], inplace=True)
-    df.rename(columns={
-        'Unnamed: 2': 'Tipo'
-    }, inplace=True)
+    df_uf = df_uf.dropna()
+    df_uf['ano_base'] = release
+    df_uf = apply_schema(df_uf, 'rais_tabela6')
 
-    macro_regions = { "Norte", "Nordeste", "Centro-Oeste", "Sudeste", "Sul" }
-    
-    is_region = df['Tipo'].isin(macro_regions)
+    write_intermediate(df_uf, output_csv, f"rais_tabela6_{release}", intermediate)
 
-    df_uf = df[~is_region]
+    return df_uf
 
-    stop_uf = df[df['Tipo'] == 'Agricultura, pecuária, produção florestal, pesca e aquicultura'].index
 
-    if not stop_uf.empty:
-        df_uf = df_uf.loc[:stop_uf[0]-1]
+def keep_latest_release(df, keys):
+    """ Keep, for each key, only the rows of the most recent RAIS release.
 
-    df_uf = df_uf.dropna()
+    Consecutive releases overlap by one year, and the newer one wins.
 
-    df_uf = df_uf.melt(
-        id_vars=['Tipo'],
-        var_name='Ano',
-        value_name='Renumeração'
-    )
+    Args:
+        df: DataFrame with an 'ano_base' column.
+        keys: Columns identifying the same observation across releases.
+    """
+    latest = df.groupby(keys, dropna=False, observed=True)['ano_base'].transform('max')
+    return df[df['ano_base'] == latest]
 
-    df_uf.rename(columns={
-        'Tipo': 'uf_nome',
-        'Ano': 'ano',
-        'Renumeração': 'media_remuneracao'
-    }, inplace=True)
 
-    df_uf['media_remuneracao'] = df_uf['media_remuneracao'].str.replace('.', '', regex=False)
-    df_uf['media_remuneracao'] = df_uf['media_remuneracao'].str.replace(',', '.', regex=False)
+def join_rais_4(frames, output_csv, crosswalk_csv=None):
+    """ Join processed RAIS Tabela 4 data of any number of years and save it to a new location.
 
-    output_file_uf = os.path.join(output_csv, 'rais_tabela6_2023.csv')
-    if os.path.exists(output_file_uf):
-        open(output_file_uf, 'w').close()
+    The release with municipality codes is used as the reference index, built
+    once, and the municipalities of every release without codes are matched
+    against it.
 
-    df_uf.to_csv(output_file_uf, index=False, sep=';')
+    Args:
+        frames: List of DataFrames returned by process_rais_4.
+        output_csv: Path to the directory where the processed CSV file will be saved.
+        crosswalk_csv: Path to the municipality crosswalk cache. Defaults to 'municipio_crosswalk.csv' in output_csv.
+    """
+    frames = sorted(frames, key=lambda df: df['ano_base'].max())
+    count_rows(rows_in=sum(len(df) for df in frames))
 
-    return
+    coded = [df for df in frames if 'municipio_cod' in df.columns]
+    if not coded:
+        raise ValueError("At least one RAIS Tabela 4 file must have the municipality codes ('Código' column)")
 
+    reference = coded[-1][['uf_sigla', 'municipio_cod', 'municipio_nome']].drop_duplicates()
+    reference['name_norm'] = normalize_series(reference['municipio_nome'])
 
-def join_rais_4(rais_4_2021, rais_4_2023, output_csv):
-    """ Join the RAIS Tabela 4 2021 and 2023 CSV files and save it to a new location.
+    final_df = pd.concat(frames, ignore_index=True)
+    missing = final_df['municipio_cod'].isna()
 
-    Args:
-        rais_4_2021: Path to the RAIS Tabela 4 2021 CSV file.
-        rais_4_2023: Path to the RAIS Tabela 4 2023 CSV file.
-        output_csv: Path to the directory where the processed CSV file will be saved.
-    """
-    df_2021 = pd.read_csv(rais_4_2021, sep=';')
-    df_2023 = pd.read_csv(rais_4_2023, sep=';')
+    if missing.any():
+        final_df['municipio_nome'] = final_df['municipio_nome'].astype(object)
 
-    df_2021['name_norm'] = df_2021['municipio_nome'].apply(normalize_string)
-    df_2023['name_norm'] = df_2023['municipio_nome'].apply(normalize_string)
+        keys = pd.DataFrame({
+            'uf_sigla': final_df.loc[missing, 'uf_sigla'],
+            'name_norm': normalize_series(final_df.loc[missing, 'municipio_nome'])
+        })
 
-    df_2021['matched_index'] = None
-    df_2021['match_score'] = None
+        if crosswalk_csv is None:
+            crosswalk_csv = os.path.join(output_csv, 'municipio_crosswalk.csv')
 
-    for idx, row in df_2021.iterrows():
-        uf = row['uf_sigla']
-        name_norm = row['name_norm']
+        # Reuse the cached matches and only resolve the names that were never seen against this reference
+        reference_hash = hash_reference(reference)
+        crosswalk = load_crosswalk(crosswalk_csv, reference_hash)
 
-        candidates = df_2023[df_2023['uf_sigla'] == uf]
+        unseen = keys.drop_duplicates().merge(crosswalk[['uf_sigla', 'name_norm']], on=['uf_sigla', 'name_norm'], how='left', indicator=True)
+        unseen = unseen[(unseen['_merge'] == 'left_only') & unseen['uf_sigla'].isin(reference['uf_sigla'])].drop(columns='_merge')
 
-        if not candidates.empty:
-            match = process.extractOne(
-                name_norm, 
-                candidates['name_norm'],
-                scorer=fuzz.token_sort_ratio
-            )
-            if match:
-                best_match, score, index = match
-                matched_row = candidates.loc[index]
-                df_2021.at[idx, 'matched_index'] = matched_row.name
-                df_2021.at[idx, 'match_score'] = score
-    
-    df_2021['municipio_nome'] = df_2021['matched_index'].apply(lambda idx: df_2023.loc[idx, 'municipio_nome'] if pd.notnull(idx) else None)
-    df_2021['municipio_cod'] = df_2021['matched_index'].apply(lambda idx: df_2023.loc[idx, 'municipio_cod'] if pd.notnull(idx) else None)
+        if not unseen.empty:
+            matches = match_municipios(unseen, reference)
+            matches['reference_hash'] = reference_hash
+            crosswalk = pd.concat([crosswalk, matches[CROSSWALK_COLUMNS]], ignore_index=True) if not crosswalk.empty else matches[CROSSWALK_COLUMNS]
+            save_crosswalk(crosswalk, crosswalk_csv)
 
-    df_2021 = df_2021[['uf_sigla', 'municipio_cod', 'municipio_nome', 'setor_nome', 'ano', 'num_pessoas_empregadas']]
-    df_2023 = df_2023[['uf_sigla', 'municipio_cod', 'municipio_nome', 'setor_nome', 'ano', 'num_pessoas_empregadas']]
+        # Broadcast the matches back to every row
+        matches = keys.merge(crosswalk[['uf_sigla', 'name_norm', 'municipio_cod', 'municipio_nome']], on=['uf_sigla', 'name_norm'], how='left')
+        final_df.loc[missing, 'municipio_cod'] = matches['municipio_cod'].to_numpy()
+        final_df.loc[missing, 'municipio_nome'] = matches['municipio_nome'].to_numpy()
 
-    final_df = pd.concat([df_2021, df_2023], ignore_index=True)
     final_df = final_df[final_df['uf_sigla'] != 'NI']
     final_df = final_df.dropna()
+    final_df = keep_latest_release(final_df, ['municipio_cod', 'setor_nome', 'ano'])
+
+    # Accent-folded search keys of the names, stored on the graph nodes
+    final_df['municipio_busca'] = normalize_series(final_df['municipio_nome'])
+    final_df['setor_busca'] = normalize_series(final_df['setor_nome'])
 
-    final_df['municipio_cod'] = final_df['municipio_cod'].astype(int)
-    final_df['ano'] = final_df['ano'].astype(int)
-    final_df['num_pessoas_empregadas'] = final_df['num_pessoas_empregadas'].astype(int)
+    final_df = apply_schema(final_df, 'rais_tabela4_joined')
 
     output_file = os.path.join(output_csv, 'rais_tabela4_joined.csv')
     if os.path.exists(output_file):
@@ -468,25 +768,24 @@ def join_rais_4(rais_4_2021, rais_4_2023, output_csv):
 
     final_df.to_csv(output_file, index=False, sep=';')
 
-    return
+    return final_df
     
 
-def join_rais_6(rais_6_2021, rais_6_2023, output_csv):
-    """ Join the RAIS Tabela 6 2021 and 2023 CSV files and save it to a new location.
+def join_rais_6(frames, output_csv):
+    """ Join processed RAIS Tabela 6 data of any number of years and save it to a new location.
 
     Args:
-        rais_6_2021: Path to the RAIS Tabela 6 2021 CSV file.
-        rais_6_2023: Path to the RAIS Tabela 6 2023 CSV file.
+        frames: List of DataFrames returned by process_rais_6.
         output_csv: Path to the directory where the processed CSV file will be saved.
     """
-    df_rais_6_2021 = pd.read_csv(rais_6_2021, sep=';')
-    df_rais_6_2023 = pd.read_csv(rais_6_2023, sep=';')
-
-    df_joined = pd.concat([df_rais_6_2021, df_rais_6_2023], ignore_index=True)
+    frames = sorted(frames, key=lambda df: df['ano_base'].max())
+    count_rows(rows_in=sum(len(df) for df in frames))
+    df_joined = pd.concat(frames, ignore_index=True)
+    df_joined = keep_latest_release(df_joined, ['uf_nome', 'ano']).drop(columns='ano_base')
 
     df_joined = df_joined.merge(lookup_df[['uf_nome', 'uf_sigla']], on='uf_nome', how='left')
 
-    df_joined['ano'] = df_joined['ano'].astype(int)
+    df_joined = apply_schema(df_joined, 'rais_tabela6_joined')
 
     output_file = os.path.join(output_csv, 'rais_tabela6_joined.csv')
     if os.path.exists(output_file):
@@ -494,43 +793,120 @@ def join_rais_6(rais_6_2021, rais_6_2023, output_csv):
 
     df_joined.to_csv(output_file, index=False, sep=';')
 
-    return
+    return df_joined
+
+
+def build_stages(indicadores_csv, rais_4_csv, rais_6_csv, output_csv, crosswalk_csv=None, chunksize=None, intermediate=None, manifest=None):
+    """ Describe the preprocessing pipeline as a DAG of stages.
 
+    There is one stage per RAIS file, named after its base year (e.g.
+    'rais4_2023'), and one join stage per table that depends on all of them.
+    Input files not given in this run are taken from the manifest of the
+    previous run, so a run without inputs only rebuilds what changed.
+
+    Args:
+        indicadores_csv: Path to the CSV file containing the indicadores data.
+        rais_4_csv: List of paths to the CSV files containing the RAIS Tabela 4 data.
+        rais_6_csv: List of paths to the CSV files containing the RAIS Tabela 6 data.
+        output_csv: Path to the directory where the processed CSV files will be saved.
+        crosswalk_csv: Path to the municipality crosswalk cache used by the RAIS Tabela 4 join.
+        chunksize: Number of rows per chunk when streaming the indicadores data.
+        intermediate: Format of the intermediate files ('parquet' or 'feather'), or None to not write them.
+        manifest: Dictionary loaded by load_manifest.
+    """
+    manifest = manifest or {}
+
+    inputs = {}
+    if indicadores_csv is not None:
+        inputs['indicadores'] = indicadores_csv
+    for path in rais_4_csv or []:
+        inputs[f"rais4_{read_release_year(path)}"] = path
+    for path in rais_6_csv or []:
+        inputs[f"rais6_{read_release_year(path)}"] = path
+
+    for name, recorded in manifest.items():
+        if name not in inputs and re.fullmatch(r"indicadores|rais[46]_\d{4}", name) and os.path.exists(recorded['inputs'][0]):
+            inputs[name] = recorded['inputs'][0]
+
+    stages = {}
+    if 'indicadores' in inputs:
+        stages['indicadores'] = make_stage(
+            'indicadores', process_indicadores,
+            args=(inputs['indicadores'], output_csv),
+            inputs=[inputs['indicadores']],
+            outputs=[os.path.join(output_csv, 'indicadores_educacao.csv')],
+            code=CODE_VERSION,
+            options={'chunksize': chunksize}
+        )
+
+    for table, func in (('4', process_rais_4), ('6', process_rais_6)):
+        names = sorted(name for name in inputs if name.startswith(f"rais{table}_"))
+        for name in names:
+            stages[name] = make_stage(
+                name, func,
+                args=(inputs[name], output_csv, intermediate),
+                inputs=[inputs[name]],
+                cache=partial(find_intermediate, output_csv, name.replace('rais', 'rais_tabela')),
+                load=read_intermediate,
+                code=CODE_VERSION
+            )
 
-def main(indicadores_csv, rais_4_csv, rais_6_csv, bool_rais4, bool_rais6, output_csv):
+    if any(name.startswith('rais4_') for name in stages):
+        stages['join_rais4'] = make_stage(
+            'join_rais4', join_rais_4,
+            args=(output_csv, crosswalk_csv),
+            deps=[name for name in stages if name.startswith('rais4_')],
+            outputs=[os.path.join(output_csv, 'rais_tabela4_joined.csv')],
+            code=CODE_VERSION
+        )
+    if any(name.startswith('rais6_') for name in stages):
+        stages['join_rais6'] = make_stage(
+            'join_rais6', join_rais_6,
+            args=(output_csv,),
+            deps=[name for name in stages if name.startswith('rais6_')],
+            outputs=[os.path.join(output_csv, 'rais_tabela6_joined.csv')],
+            code=CODE_VERSION
+        )
+
+    return stages
+
+
+def main(indicadores_csv, rais_4_csv, rais_6_csv, output_csv, crosswalk_csv=None, chunksize=None, intermediate=None, force=None, dry_run=False, jobs=1, metrics_file=None):
     """ Main function to process the CSV files.
 
+    Each stage only reruns when the fingerprint of its inputs, parameters or
+    code differs from the one recorded in the manifest of the output directory.
+    The processed RAIS tables are handed to the join stages in memory, and
+    with jobs > 1 the independent stages run in parallel processes.
+
     Args:
         indicadores_csv: Path to the CSV file containing the indicadores data.
-        rais_4_csv: Path to the CSV file containing the RAIS Tabela 4 data.
-        rais_6_csv: Path to the CSV file containing the RAIS Tabela 6 data.
-        bool_rais4: Boolean to recreate the RAIS Tabela 4 data.
-        bool_rais6: Boolean to recreate the RAIS Tabela 6 data.
+        rais_4_csv: List of paths to the CSV files containing the RAIS Tabela 4 data.
+        rais_6_csv: List of paths to the CSV files containing the RAIS Tabela 6 data.
         output_csv: Path to the directory where the processed CSV file will be saved.
+        crosswalk_csv: Path to the municipality crosswalk cache used by the RAIS Tabela 4 join.
+        chunksize: Number of rows per chunk when streaming the indicadores data.
+        intermediate: Format of the intermediate files ('parquet' or 'feather'), or None to not write them.
+        force: List of stage names to rebuild regardless of the manifest, or ['all'].
+        dry_run: Boolean to only list the stages that would be rebuilt.
+        jobs: Number of worker processes used to run independent stages in parallel.
+        metrics_file: Path to a JSON-lines file where the wall time, rows and peak memory of each stage are appended, or None.
     """
-    if indicadores_csv is not None and output_csv is not None:
-        process_indicadores(indicadores_csv, output_csv)
-    if rais_4_csv is not None and output_csv is not None:
-        if "2021" in rais_4_csv:
-            process_rais_4_2021(rais_4_csv, output_csv)
-        if "2023" in rais_4_csv:
-            process_rais_4_2023(rais_4_csv, output_csv)
-    if rais_6_csv is not None and output_csv is not None:
-        if "2021" in rais_6_csv:
-            process_rais_6_2021(rais_6_csv, output_csv)
-        if "2023" in rais_6_csv:
-            process_rais_6_2023(rais_6_csv, output_csv)
-
-    rais_4_2021 = f"{output_csv}/rais_tabela4_2021.csv"
-    rais_4_2023 = f"{output_csv}/rais_tabela4_2023.csv"
-    rais_6_2021 = f"{output_csv}/rais_tabela6_2021.csv"
-    rais_6_2023 = f"{output_csv}/rais_tabela6_2023.csv"
-
-    # Check if the files exist
-    if os.path.exists(rais_4_2021) and os.path.exists(rais_4_2023) and bool_rais4 == "True":
-        join_rais_4(rais_4_2021, rais_4_2023, output_csv)
-    if os.path.exists(rais_6_2021) and os.path.exists(rais_6_2023) and bool_rais6 == "True":
-        join_rais_6(rais_6_2021, rais_6_2023, output_csv)
+    if output_csv is None:
+        return
+
+    manifest_file = os.path.join(output_csv, MANIFEST_NAME)
+    manifest = load_manifest(manifest_file)
+
+    stages = build_stages(indicadores_csv, rais_4_csv, rais_6_csv, output_csv, crosswalk_csv, chunksize, intermediate, manifest)
+    fingerprints, plan = plan_stages(stages, manifest, force)
+    print_plan(stages, plan)
+
+    if dry_run:
+        return
+
+    metrics = open_metrics(metrics_file, 'process_datasets')
+    run_stages(stages, plan, fingerprints, manifest, manifest_file, jobs, metrics)
     return
 
 
@@ -547,39 +923,80 @@ if __name__ == "__main__":
     parser.add_argument(
         "-r4",
         "--rais_4",
+        nargs="+",
         default=None,
-        help="Path to the CSV file containing the RAIS Tabela 4 data."
+        help="Paths to the CSV files containing the RAIS Tabela 4 data, one per base year."
     )
     parser.add_argument(
         "-r6",
         "--rais_6",
+        nargs="+",
         default=None,
-        help="Path to the CSV file containing the RAIS Tabela 6 data."
+        help="Paths to the CSV files containing the RAIS Tabela 6 data, one per base year."
     )
     parser.add_argument(
-        "-b4",
-        "--bool_rais4",
-        default=False,
-        help="Boolean to recreate the RAIS Tabela 4 data."
+        "-o",
+        "--output",
+        default=None,
+        help="Path to the directory where the processed CSV file will be saved."
     )
     parser.add_argument(
-        "-b6",
-        "--bool_rais6",
-        default=False,
-        help="Boolean to recreate the RAIS Tabela 6 data."
+        "-x",
+        "--crosswalk",
+        default=None,
+        help="Path to the municipality crosswalk cache. Defaults to municipio_crosswalk.csv in the output directory."
     )
     parser.add_argument(
-        "-o",
-        "--output",
+        "-cs",
+        "--chunksize",
+        type=int,
         default=None,
-        help="Path to the directory where the processed CSV file will be saved."
+        help="Number of rows per chunk when streaming the indicadores data. Reads the whole file at once by default."
+    )
+    parser.add_argument(
+        "-if",
+        "--intermediate",
+        choices=INTERMEDIATE_FORMATS,
+        default=None,
+        help="Also save the processed RAIS tables in this format, so later runs can join them without reprocessing."
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="append",
+        default=None,
+        help="Rebuild this stage (e.g. rais4_2023, join_rais4 or all) even if it is up to date. Can be repeated."
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Only list the stages that would be rebuilt."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to run independent stages in parallel."
+    )
+    parser.add_argument(
+        "-m",
+        "--metrics",
+        default=None,
+        help="Append the wall time, rows and peak memory of each stage to this JSON-lines file."
     )
     args = parser.parse_args()
     indicadores_csv = args.indicadores
     rais_4_csv = args.rais_4
     rais_6_csv = args.rais_6
-    bool_rais4 = args.bool_rais4
-    bool_rais6 = args.bool_rais6
     output_csv = args.output
-
-    main(indicadores_csv, rais_4_csv, rais_6_csv, bool_rais4, bool_rais6, output_csv)
+    crosswalk_csv = args.crosswalk
+    chunksize = args.chunksize
+    intermediate = args.intermediate
+    force = args.force
+    dry_run = args.dry_run
+    jobs = args.jobs
+    metrics_file = args.metrics
+
+    main(indicadores_csv, rais_4_csv, rais_6_csv, output_csv, crosswalk_csv, chunksize, intermediate, force, dry_run, jobs, metrics_file)
@@ -1,110 +1,234 @@
 from neo4j import GraphDatabase
+import argparse
 import csv
 import os
 
+from instrumentation import measure, open_metrics, summary_counters
+from process_datasets import normalize_string
+
 # Conexão
 NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "12345678"
 
-# Queries
+# Conversão dos valores de parâmetro passados na linha de comando, por tipo declarado
+PARAMETER_TYPES = {
+    'str': str,
+    'int': int,
+    'float': float,
+    # Termos de busca, comparados com a chave 'busca' dos nós (sem acentos e em minúsculas)
+    'search': normalize_string,
+    'search_list': lambda value: [normalize_string(item) for item in value.split(',') if normalize_string(item)]
+}
+
+# Queries: cada uma declara seus parâmetros, com tipo e valor padrão. Como os
+# valores são enviados como parâmetros, o texto da consulta não muda entre as
+# variações e o Neo4j reaproveita o mesmo plano de execução em cache.
 QUERIES = {
 
     # QUERY 1
     # No setor de agrupecuária, quais instituições oferecem cursos em áreas de atuação relacionadas a ele e qual o número de pessoas empregadas neste setor em cada município?
     # Identifica regiões com maior empregabilidade para alunos de determinada área.
 
-    "1. Cursos, áreas e empregos por setor em 2023": """
+    "1. Cursos, áreas e empregos por setor": {
+        'parameters': {
+            'setor': ('search', 'agropecuaria'),
+            'cursos': ('search_list', ['agro', 'amb']),
+            'ano': ('int', 2023)
+        },
+        'query': """
         MATCH (s:SetorEconomico)
-        WHERE toLower(s.nome) CONTAINS "agropecuária" 
+        WHERE s.busca CONTAINS $setor
+        UNWIND $cursos AS termo
         MATCH (c:Curso)
-        WHERE toLower(c.nome) CONTAINS "agro" OR toLower(c.nome) CONTAINS "amb"
-        MATCH (c:Curso)-[:PERTENCE_A]->(a:AreaAtuacao)-[:ESTA_RELACIONADO_A]->(s),
-        (s)-[r:NUMERO_PESSOAS_EMPREGADAS {ano: 2023}]->(m:Municipio)
-        RETURN DISTINCT c.nome AS Curso, a.nome AS Area, s.nome AS Setor, m.nome AS Municipio, r.num_empregados AS Empregados
+        WHERE c.busca CONTAINS termo
+        WITH DISTINCT s, c
+        MATCH (c:Curso)-[:PERTENCE_A]->(a:AreaAtuacao)-[:ESTA_RELACIONADO_A]->(s)
+        MATCH (e:Emprego {setor: s.nome, ano: $ano})-[:EM_MUNICIPIO]->(m:Municipio)
+        RETURN DISTINCT c.nome AS Curso, a.nome AS Area, s.nome AS Setor, m.nome AS Municipio, e.num_empregados AS Empregados
         ORDER BY Empregados DESC
-    """,
+        """
+    },
 
     # QUERY 2
     # Procurando por um curso específico, buscamos quais são as instituições que oferecem-no e qual a média de remuneração do estado no qual ela está localizada.
     # Pode ajudar estudantes a escolher instituições em regiões com melhores perspectivas salariais, caso esse seja o objetivo. Saber a média salarial do estado como um todo é interessante pois muitas vezes as pessoas são graduadas em uma área e acabam migrando para outra ao se formarem ou ao longo da vida.
 
-    "2. Cursos, instituições e remuneração média por estado em 2023": """
+    "2. Cursos, instituições e remuneração média por estado": {
+        'parameters': {
+            'curso': ('search', 'computacao'),
+            'ano': ('int', 2023)
+        },
+        'query': """
         MATCH (c:Curso)
-        WHERE toLower(c.nome) CONTAINS "computação"
-        MATCH (c)-[:PERTENCE_A]->(i:InstituicaoSuperior)-[:LOCALIZADA_EM]->(u:UnidadeFederativa),
-        (u)-[r:MEDIA_REMUNERACAO_ANUAL {ano: 2023}]->(med:MediaRemuneracao)
-        RETURN DISTINCT c.nome AS Curso, i.nome AS Instituicao, u.nome AS Estado, med.media_remuneracao AS Remuneracao
+        WHERE c.busca CONTAINS $curso
+        MATCH (c)-[:OFERECIDO_POR]->(i:InstituicaoSuperior)-[:LOCALIZADA_EM]->(u:UnidadeFederativa)
+        WITH c, i, u, u['media_remuneracao_' + toString($ano)] AS remuneracao
+        WHERE remuneracao IS NOT NULL
+        RETURN DISTINCT c.nome AS Curso, i.nome AS Instituicao, u.nome AS Estado, remuneracao AS Remuneracao
         ORDER BY Curso ASC, Remuneracao DESC
-    """,
+        """
+    },
 
     # QUERY 3
     # Em quais áreas de atuação os setores empregaram mais pessoas em 2023 no estado de São Paulo, com exceção de sua capital?
     # Relaciona formação acadêmica por área de atuação com a demanda do mercado local.
 
-    "3. Área, depois setor, depois município com mais empregos em 2023": """
-        MATCH (uf:UnidadeFederativa)
-        WHERE uf.sigla CONTAINS 'SP'
-        MATCH (m:Municipio)
-        WHERE m.nome <> 'São Paulo'
-        MATCH (a:AreaAtuacao)-[:ESTA_RELACIONADO_A]->(s:SetorEconomico),
-        (s)-[r:NUMERO_PESSOAS_EMPREGADAS {ano: 2023}]->(m), (m)-[:LOCALIZADO_EM]->(uf) 
-        RETURN a.nome AS Area, s.nome AS Setor, m.nome AS Municipio, r.num_empregados AS Empregados
+    "3. Área, depois setor, depois município com mais empregos": {
+        'parameters': {
+            'uf': ('str', 'SP'),
+            'excluir_municipio': ('search', 'sao paulo'),
+            'ano': ('int', 2023)
+        },
+        'query': """
+        MATCH (uf:UnidadeFederativa {sigla: $uf})
+        MATCH (m:Municipio)-[:LOCALIZADO_EM]->(uf)
+        WHERE m.busca <> $excluir_municipio
+        MATCH (a:AreaAtuacao)-[:ESTA_RELACIONADO_A]->(s:SetorEconomico)
+        MATCH (e:Emprego {setor: s.nome, municipio: m.codigo, ano: $ano})
+        RETURN a.nome AS Area, s.nome AS Setor, m.nome AS Municipio, e.num_empregados AS Empregados
         ORDER BY Empregados DESC
-    """,
+        """
+    },
 
     # QUERY 4
     # Quais cursos têm mais evasão nas instituições e de quais estados?
     # Ajuda a identificar cursos críticos com alta evasão.
 
-    "4. Cursos com alta evasão (Taxa de desistência > 50.0)": """
-        MATCH (c:Curso)-[:PERTENCE_A]->(i:InstituicaoSuperior)-[:LOCALIZADA_EM]->(u:UnidadeFederativa),
+    "4. Cursos com alta evasão": {
+        'parameters': {
+            'taxa_minima': ('float', 0.5),
+            'limite': ('int', 1000)
+        },
+        'query': """
+        MATCH (c:Curso)-[:OFERECIDO_POR]->(i:InstituicaoSuperior)-[:LOCALIZADA_EM]->(u:UnidadeFederativa),
               (c)-[r:TRAJETORIA_DO_CURSO]->(m:Municipio)
-        WHERE toFloat(r.taxa_desistencia) > 0.5
+        WHERE r.taxa_desistencia > $taxa_minima
         RETURN DISTINCT c.nome AS Curso, i.nome AS Instituicao, u.nome AS Estado, r.ano AS Ano, r.taxa_desistencia AS Taxa
         ORDER BY Taxa DESC
-        LIMIT 1000
-    """,
+        LIMIT $limite
+        """
+    },
 
 
     # QUERY 5
     # Qual a relação entre estados que tiveram queda na remuneração média e o aumento da taxa de desistência dos cursos de graduação?
     # Ajuda a entender se a diminuição da remuneração média está correlacionada com o aumento da taxa de desistência dos cursos.
 
-    "5. Relação entre estados com queda na remuneração e taxa de desistência média dos cursos de graduação": """
+    "5. Relação entre estados com queda na remuneração e taxa de desistência média dos cursos de graduação": {
+        'parameters': {
+            'ano_inicial': ('int', 2020),
+            'ano_final': ('int', 2023)
+        },
+        'query': """
         MATCH (uf:UnidadeFederativa)
-        MATCH (uf)-[:MEDIA_REMUNERACAO_ANUAL {ano: 2020}]->(rem2020:MediaRemuneracao), (uf)-[:MEDIA_REMUNERACAO_ANUAL {ano: 2023}]->(rem2023:MediaRemuneracao)
+        WITH uf, uf['media_remuneracao_' + toString($ano_inicial)] AS rem_inicial, uf['media_remuneracao_' + toString($ano_final)] AS rem_final
+        WHERE rem_inicial IS NOT NULL AND rem_final IS NOT NULL
         
-        WITH uf, (toFloat(rem2023.media_remuneracao) - toFloat(rem2020.media_remuneracao)) AS delta_remuneracao
+        WITH uf, (rem_final - rem_inicial) AS delta_remuneracao
 
-        MATCH (uf)<-[:LOCALIZADA_EM]-(i:InstituicaoSuperior)<-[:PERTENCE_A]-(c:Curso),(c)-[traj2020:TRAJETORIA_DO_CURSO {ano: 2020}]->(:Municipio), (c)-[traj2023:TRAJETORIA_DO_CURSO {ano: 2023}]->(:Municipio)
+        MATCH (uf)<-[:LOCALIZADA_EM]-(i:InstituicaoSuperior)<-[:OFERECIDO_POR]-(c:Curso),(c)-[traj_inicial:TRAJETORIA_DO_CURSO {ano: $ano_inicial}]->(:Municipio), (c)-[traj_final:TRAJETORIA_DO_CURSO {ano: $ano_final}]->(:Municipio)
 
         WITH 
             uf.nome AS uf_nome,
             delta_remuneracao,
-            avg(toFloat(traj2023.taxa_desistencia)) - avg(toFloat(traj2020.taxa_desistencia)) AS delta_desistencia
+            avg(traj_final.taxa_desistencia) - avg(traj_inicial.taxa_desistencia) AS delta_desistencia
 
         WHERE delta_desistencia > 0 AND delta_remuneracao < 0
         RETURN uf_nome AS Estado, round(delta_desistencia, 2) AS Aumento_Desistencia, round(delta_remuneracao, 2) AS Variacao_Remuneracao
-        ORDER BY Aumento_Desistencia DESC;
-    """
+        ORDER BY Aumento_Desistencia DESC
+        """
+    }
 }
 
+
+# Funções para montar os parâmetros das queries
+def query_parameters(title, overrides=None):
+    """Builds the parameters of a query from its declared defaults and the given overrides.
+
+    Args:
+        title (str): Title of the query in QUERIES.
+        overrides (dict): Parameter values by name, either typed or as text to be converted to the declared type.
+    """
+    declared = QUERIES[title]['parameters']
+    parameters = {name: default for name, (_, default) in declared.items()}
+    for name, value in (overrides or {}).items():
+        if name not in declared:
+            continue
+        kind = declared[name][0]
+        parameters[name] = PARAMETER_TYPES[kind](value) if isinstance(value, str) else value
+    return parameters
+
+
+def parse_parameters(values):
+    """Parses the --param arguments, each one NAME=VALUE.
+
+    Args:
+        values (list): List of strings.
+    """
+    overrides = {}
+    for value in values or []:
+        name, sep, text = value.partition('=')
+        if not sep:
+            raise ValueError(f"Invalid parameter {value!r}, expected NAME=VALUE")
+        overrides[name] = text
+    return overrides
+
+
+def select_queries(numbers=None, overrides=None):
+    """Returns the titles of the selected queries, checking that every override is declared by one of them.
+
+    Args:
+        numbers (list): Numbers of the queries to run, or None for all of them.
+        overrides (dict): Parameter values by name.
+    """
+    titles = list(QUERIES)
+    if numbers:
+        unknown = [number for number in numbers if not 1 <= number <= len(titles)]
+        if unknown:
+            raise ValueError(f"Unknown queries: {', '.join(map(str, unknown))}. Available queries: 1 to {len(titles)}")
+        titles = [titles[number - 1] for number in numbers]
+
+    declared = {name for title in titles for name in QUERIES[title]['parameters']}
+    unknown = set(overrides or {}) - declared
+    if unknown:
+        raise ValueError(f"Parameters not declared by the selected queries: {', '.join(sorted(unknown))}")
+    return titles
+
+
+def print_catalog():
+    """Prints every query of the catalog with its parameters, types and defaults."""
+    for title, spec in QUERIES.items():
+        print(title)
+        for name, (kind, default) in spec['parameters'].items():
+            default = ','.join(default) if isinstance(default, list) else default
+            print(f"    {name:<18} {kind:<11} default: {default}")
+
 # Função para executar as queries e salvar em CSV
-def run_queries(driver):
+def run_queries(driver, metrics=None, numbers=None, overrides=None):
     """Executes a series of predefined queries against a Neo4j database and saves the results to CSV files.
 
     Args:
         driver (GraphDatabase.Driver): The Neo4j driver to connect to the database.
+        metrics (dict): Dictionary returned by instrumentation.open_metrics, or None to not record the queries.
+        numbers (list): Numbers of the queries to run, or None to run all of them.
+        overrides (dict): Parameter values by name, replacing the defaults of every selected query that declares them.
     """
+    titles = select_queries(numbers, overrides)
     os.makedirs("queries", exist_ok=True)  # Create a folder for CSVs
 
     with driver.session() as session:
-        for idx, (title, query) in enumerate(QUERIES.items(), start=1):
+        for title in titles:
+            idx = list(QUERIES).index(title) + 1
+            parameters = query_parameters(title, overrides)
             print(f"\n {title}\n{'-' * len(title)}")
-            result = session.run(query)
-
-            records = [dict(record) for record in result]
+            print(f"Parameters: {parameters}")
+            with measure(metrics, 'query', title) as stats:
+                stats['parameters'] = parameters
+                result = session.run(QUERIES[title]['query'], parameters)
+                records = [dict(record) for record in result]
+                stats['rows_out'] = len(records)
+                stats.update(summary_counters(result.consume()))
 
             # Print to terminal
             for record in records:
@@ -122,14 +246,58 @@ def run_queries(driver):
                 print("No results found.")
 
 # Função principal
-def main():
+def main(metrics_file=None, numbers=None, overrides=None, list_only=False):
     """Main function to execute a series of Neo4j queries and save results to CSV files.
+
+    Args:
+        metrics_file (str): Path to a JSON-lines file where the timings and counters of each query are appended, or None.
+        numbers (list): Numbers of the queries to run, or None to run all of them.
+        overrides (dict): Parameter values by name, as given with --param.
+        list_only (bool): Only print the catalog of queries and their parameters.
     """
+    if list_only:
+        print_catalog()
+        return
+
+    # Validate the selection before connecting
+    select_queries(numbers, overrides)
+
     driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
     try:
-        run_queries(driver)
+        run_queries(driver, open_metrics(metrics_file, 'queries'), numbers, overrides)
     finally:
         driver.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Run the graph queries and save their results to CSV files."
+    )
+    parser.add_argument(
+        "--metrics",
+        "-m",
+        default=None,
+        help="Append the wall time, rows and result counters of each query to this JSON-lines file."
+    )
+    parser.add_argument(
+        "--query",
+        "-q",
+        nargs="+",
+        type=int,
+        default=None,
+        help="Numbers of the queries to run (e.g. 1 3). All of them by default."
+    )
+    parser.add_argument(
+        "--param",
+        "-p",
+        nargs="+",
+        default=None,
+        help="Parameter values as NAME=VALUE, replacing the defaults of the selected queries (e.g. ano=2022 uf=RJ cursos=agro,amb)."
+    )
+    parser.add_argument(
+        "--list",
+        "-l",
+        action="store_true",
+        help="List the queries with their parameters, types and defaults."
+    )
+    args = parser.parse_args()
+    main(args.metrics, args.query, parse_parameters(args.param), args.list)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import pipeline
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def concat(dep_results):
+    return ''.join(dep_results)
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def build(tmp_path):
+    """ Two input stages joined by a third one, like the RAIS stages of process_datasets.py. """
+    first = write(tmp_path / 'first.csv', 'a')
+    second = write(tmp_path / 'second.csv', 'b')
+    output = write(tmp_path / 'joined.csv', 'ab')
+    return {
+        'first': pipeline.make_stage('first', read, args=(first,), inputs=[first]),
+        'second': pipeline.make_stage('second', read, args=(second,), inputs=[second]),
+        'join': pipeline.make_stage('join', concat, deps=['first', 'second'], outputs=[output])
+    }
+
+
+def built_manifest(stages):
+    fingerprints = pipeline.fingerprint_stages(stages)
+    return {name: {'fingerprint': fingerprints[name]} for name in stages}
+
+
+def test_up_to_date(tmp_path):
+    stages = build(tmp_path)
+    _, plan = pipeline.plan_stages(stages, built_manifest(stages))
+    assert plan == {}
+
+
+def test_forced_stage_rebuilds_dependents(tmp_path):
+    stages = build(tmp_path)
+    _, plan = pipeline.plan_stages(stages, built_manifest(stages), force=['first'])
+    assert plan == {'first': 'forced', 'second': 'needed by join', 'join': 'depends on first'}
+
+
+def test_missing_output_rebuilds_dependents(tmp_path):
+    stages = build(tmp_path)
+    stages['first']['outputs'] = [str(tmp_path / 'first_out.csv')]
+    _, plan = pipeline.plan_stages(stages, built_manifest(stages))
+    assert plan['first'] == 'output missing'
+    assert plan['join'] == 'depends on first'
+
+
+def test_options_left_out_of_fingerprint(tmp_path):
+    stages = build(tmp_path)
+    manifest = built_manifest(stages)
+    stages['first']['options'] = {'chunksize': 1000}
+    _, plan = pipeline.plan_stages(stages, manifest)
+    assert plan == {}